@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tablebase import DEFAULT_TABLEBASE_PATH, KPKTablebase, load_tablebase
+from poscache import PositionCache
+from engine import (SEARCH_MODES, TranspositionTable, RootSearchPool, iterative_deepening, parse_position_line, move_to_text,
+                    set_tablebase)
+
+# Batch analysis of KPK positions.
+#
+#   python analyze.py positions.epd --depth 6 --workers 8 --output results.jsonl
+#   cat positions.txt | python analyze.py - --movetime 0.5
+#
+# Each input line is a FEN/EPD record ("8/8/4k3/8/8/8/3P4/4K3 w - - 0 1") or three squares
+# for WK, WP and BK with an optional side to move ("e1 d2 e6 w"). Blank lines and lines
+# starting with '#' are skipped. One JSON object is written per position, in input order.
+# Only a bounded window of positions is in flight at any time, so memory does not grow with
+# the input. When --output names an existing file, positions already written there are skipped.
+# With --cache (and --no-tablebase, since the tablebase answers every KPK position before the search
+# would probe the cache) every worker reads and extends a persistent position cache shared with
+# other runs (results may then depend on what earlier runs searched).
+# With --root-workers N positions are analyzed one at a time, each with its root moves split across
+# N processes (engine.RootSearchPool, fixed --depth only). Use it for a few deep searches; for many
+# positions --workers is faster, since parallel root search does extra work (see bench.py --parallel).
+
+TT_ENTRIES_PER_POSITION = 100000
+
+# Persistent position cache of this process, opened by _init_worker
+_position_cache = None
+
+def analyze_line(line_number, line, depth, movetime, mode='alphabeta', root_pool=None):
+    # Analyzes one position and returns its JSON-ready result record
+    record = {'line': line_number, 'input': line}
+    try:
+        position = parse_position_line(line)
+    except ValueError as e:
+        record['error'] = str(e)
+        return record
+    # A fresh transposition table per position keeps results independent of processing order
+    if root_pool is not None:
+        root_pool.clear()
+        result = root_pool.search(position, depth, {})
+    else:
+        result = iterative_deepening(position, {}, max_depth=depth, time_limit=movetime,
+                                     tt=TranspositionTable(max_entries=TT_ENTRIES_PER_POSITION), cache=_position_cache, mode=mode)
+    record['best_move'] = move_to_text(position, result.move) if result.move else None
+    record['score'] = result.score
+    record['depth'] = result.depth
+    record['nodes'] = result.nodes
+    record['time'] = round(result.elapsed, 4)
+    record['pv'] = [move_to_text(*step) for step in _pv_with_positions(position, result.pv)]
+    return record
+
+def _pv_with_positions(position, pv):
+    # Pairs every principal variation move with the position it is played in
+    position = position.copy()
+    for move in pv:
+        yield position.copy(), move
+        position.make_move(move)
+
+def _init_worker(tablebase_path, cache_path=None):
+    global _position_cache
+    set_tablebase(KPKTablebase(tablebase_path) if tablebase_path is not None else None)
+    _position_cache = PositionCache(cache_path) if cache_path is not None else None
+
+def read_positions(input_file, skip_through):
+    # Yields (line_number, text) for every position line after line skip_through
+    for line_number, line in enumerate(input_file, 1):
+        text = line.strip()
+        if line_number <= skip_through or not text or text.startswith('#'):
+            continue
+        yield line_number, text
+
+def resume_point(output_path):
+    # Last input line already written to output_path (0 if none).
+    # A partially written last record from an interrupted run is cut off.
+    if output_path is None or not os.path.exists(output_path):
+        return 0
+    last_line = 0
+    valid_size = 0
+    with open(output_path, 'rb') as f:
+        for raw in f:
+            try:
+                last_line = json.loads(raw)['line']
+            except (ValueError, KeyError):
+                break
+            valid_size += len(raw)
+    with open(output_path, 'ab') as f:
+        f.truncate(valid_size)
+    return last_line
+
+def run_batch(lines, output, depth, movetime, workers, tablebase_path, cache_path=None, mode='alphabeta', window=None, root_workers=None):
+    # Analyzes (line_number, text) pairs and writes one JSON line per position to output, in order.
+    # At most `window` positions are queued at once.
+    if root_workers:
+        _init_worker(tablebase_path) # The pool's workers use the tablebase installed here
+        with RootSearchPool(root_workers, TT_ENTRIES_PER_POSITION) as pool:
+            for line_number, text in lines:
+                output.write(json.dumps(analyze_line(line_number, text, depth, movetime, mode, pool)) + '\n')
+                output.flush()
+        return
+    if workers <= 1:
+        _init_worker(tablebase_path, cache_path)
+        for line_number, text in lines:
+            output.write(json.dumps(analyze_line(line_number, text, depth, movetime, mode)) + '\n')
+            output.flush()
+        return
+    window = window or workers * 4
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tablebase_path, cache_path)) as pool:
+        for line_number, text in lines:
+            pending.append(pool.submit(analyze_line, line_number, text, depth, movetime, mode))
+            if len(pending) >= window:
+                output.write(json.dumps(pending.popleft().result()) + '\n')
+                output.flush()
+        while pending:
+            output.write(json.dumps(pending.popleft().result()) + '\n')
+            output.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze KPK positions and stream the results as JSON lines.")
+    parser.add_argument('input', nargs='?', default='-', help="Positions file, or '-' for stdin (default)")
+    parser.add_argument('--output', '-o', help="JSONL output file (default stdout). An existing file is resumed.")
+    parser.add_argument('--depth', type=int, default=None, help="Maximum search depth (default 8 without --movetime)")
+    parser.add_argument('--movetime', type=float, default=None, help="Search time per position in seconds")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes (default: all cores)")
+    parser.add_argument('--tablebase', default=DEFAULT_TABLEBASE_PATH, help="KPK tablebase file (generated if missing)")
+    parser.add_argument('--no-tablebase', action='store_true', help="Search every position instead of using the tablebase")
+    parser.add_argument('--mode', choices=SEARCH_MODES, default='alphabeta', help="Search algorithm (default alphabeta)")
+    parser.add_argument('--cache', metavar='PATH', help="Persistent position cache (SQLite) to reuse and extend, with --no-tablebase")
+    parser.add_argument('--root-workers', type=int, metavar='N', help="Split each position's root moves across N processes")
+    args = parser.parse_args(argv)
+    if args.root_workers and (args.movetime is not None or args.cache or args.mode != 'alphabeta'):
+        parser.error("--root-workers searches to a fixed --depth with alphabeta and no --cache")
+    if args.cache and not args.no_tablebase:
+        parser.error("--cache needs --no-tablebase (tablebase positions are never searched, so never cached)")
+
+    depth = args.depth if args.depth is not None else (64 if args.movetime is not None else 8)
+    tablebase_path = None
+    if not args.no_tablebase:
+        load_tablebase(args.tablebase).close() # Generates the file once, before the workers start
+        tablebase_path = args.tablebase
+
+    skip_through = resume_point(args.output)
+    input_file = sys.stdin if args.input == '-' else open(args.input)
+    output = sys.stdout if args.output is None else open(args.output, 'a')
+    start_time = time.perf_counter()
+    try:
+        run_batch(read_positions(input_file, skip_through), output, depth, args.movetime, args.workers, tablebase_path, args.cache, args.mode,
+                  root_workers=args.root_workers)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if input_file is not sys.stdin:
+            input_file.close()
+    print(f"Finished in {time.perf_counter() - start_time:.2f}s", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import sys
+import json
+import time
+import math
+import random
+import platform
+import argparse
+from engine import (EMPTY, SEARCH_MODES, Position, SearchContext, TranspositionTable, RootSearchPool, legal_moves, in_check,
+                    evaluate_board, minimax, search_depth, iterative_deepening, parse_fen, parse_square, validate_position, set_tablebase,
+                    staged_moves, is_legal_move, move_to_text)
+
+# Reproducible benchmarks for move generation, check detection, evaluation and search.
+#
+#   python bench.py --output bench.json                 # run and save the results
+#   python bench.py --baseline bench.json               # compare against a saved run
+#
+# Every number comes from the fixed CORPUS below with the tablebase disabled, so runs on the
+# same machine are comparable. With --baseline the exit status is 1 when any rate drops or any
+# time grows by more than --tolerance.
+#
+#   python bench.py --modes alphabeta,pvs,mtdf          # node counts and times for every search mode
+#
+# With several modes, 'search' holds the first one (the one compared against a baseline),
+# 'search_modes' holds them all and 'fastest_mode' names the quickest mode to reach each depth.
+#
+#   python bench.py --parallel 8                        # parallel root search against serial search
+#
+# 'parallel' compares engine.RootSearchPool with that many workers against serial iterative
+# deepening with a transposition table, both to --max-depth: the speedup (serial time / parallel
+# time) and node_ratio (parallel nodes / serial nodes). The pool must return the score and move of a
+# plain fixed-depth minimax search (serial iterative deepening can differ, as its table reuses deeper
+# results); every position records whether it does, and the exit status is 1 when one does not.
+#
+#   python bench.py --verify-moves 100000               # check the search's move generator, no timing
+#
+# Checks on random positions that engine.staged_moves yields exactly the moves of engine.legal_moves,
+# each once, whatever principal variation, transposition table and killer moves it is given.
+
+# (name, "wk wp bk side") - pawn on every rank, promotion races and typical KPK structures
+CORPUS = [
+    ('pawn_rank2', 'e1 e2 e8 w'),
+    ('pawn_rank3', 'd2 e3 e7 w'),
+    ('pawn_rank4', 'd3 d4 d6 w'),
+    ('pawn_rank5', 'e4 e5 e7 b'),
+    ('pawn_rank6', 'f6 e6 e8 w'),
+    ('pawn_rank7', 'e6 d7 c7 w'),
+    ('race_a_pawn', 'h1 a4 h5 w'),
+    ('race_h_pawn', 'a8 h3 a5 b'),
+    ('race_b_pawn', 'h8 b5 f4 w'),
+    ('opposition', 'e5 e4 e7 w'),
+    ('rook_pawn_draw', 'a6 a5 a8 w'),
+    ('king_far', 'h1 d3 d8 w'),
+]
+
+# Search measurements shorter than this (seconds) are too noisy to flag as regressions
+MIN_COMPARED_TIME = 0.02
+
+# Positions with a promoted queen, for check detection along open and blocked lines
+QUEEN_CHECK_CORPUS = [
+    ('queen_file_check', '4k3/8/8/8/8/8/8/K3Q3 b - - 0 1'),
+    ('queen_diagonal_check', '4k3/8/8/8/Q7/8/8/K7 b - - 0 1'),
+    ('queen_blocked_by_king', '4k3/8/4K3/8/8/8/8/4Q3 b - - 0 1'),
+    ('queen_no_check', '4k3/8/8/8/8/8/8/K2Q4 b - - 0 1'),
+]
+
+def corpus_positions():
+    positions = []
+    for name, text in CORPUS:
+        wk, wp, bk, side = text.split()
+        position = Position(parse_square(wk), parse_square(wp), parse_square(bk), side == 'w')
+        validate_position(position)
+        positions.append((name, position))
+    return positions
+
+def queen_positions():
+    return [(name, parse_fen(fen)) for name, fen in QUEEN_CHECK_CORPUS]
+
+def perft(position, depth):
+    # Counts move sequences of the given length. Promotions and pawn captures end the game,
+    # so positions after them are counted as leaves.
+    if depth == 0 or position.wq != EMPTY or position.wp == EMPTY:
+        return 1
+    total = 0
+    for move in legal_moves(position):
+        undo = position.make_move(move)
+        total += perft(position, depth - 1)
+        position.unmake_move(undo)
+    return total
+
+def best_time(function, repeat):
+    # Runs function repeat times and returns (its last result, the fastest run in seconds)
+    fastest = math.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        fastest = min(fastest, time.perf_counter() - start)
+    return result, fastest
+
+def bench_perft(positions, depth, repeat):
+    results = {}
+    for name, position in positions:
+        count, elapsed = best_time(lambda: perft(position.copy(), depth), repeat)
+        results[name] = {'depth': depth, 'nodes': count, 'time': elapsed}
+    total_nodes = sum(r['nodes'] for r in results.values())
+    total_time = sum(r['time'] for r in results.values())
+    return {'positions': results, 'nodes': total_nodes, 'time': total_time, 'nodes_per_sec': total_nodes / total_time}
+
+def bench_check_detection(positions, iterations, repeat):
+    def run():
+        checks = 0
+        for _ in range(iterations):
+            for _, position in positions:
+                checks += in_check(position, True) + in_check(position, False)
+        return checks
+    _, elapsed = best_time(run, repeat)
+    calls = iterations * len(positions) * 2
+    return {'calls': calls, 'time': elapsed, 'calls_per_sec': calls / elapsed}
+
+def bench_evaluation(positions, iterations, repeat):
+    def run():
+        for _ in range(iterations):
+            for _, position in positions:
+                evaluate_board(position, {})
+    _, elapsed = best_time(run, repeat)
+    calls = iterations * len(positions)
+    return {'evaluations': calls, 'time': elapsed, 'evals_per_sec': calls / elapsed}
+
+def bench_search(positions, max_depth, repeat, mode='alphabeta'):
+    # Fixed-depth search (move ordering, no transposition table except the one MTD(f) needs) and
+    # iterative deepening with a fresh transposition table, for every depth from 1 to max_depth
+    depths = {}
+    for depth in range(1, max_depth + 1):
+        nodes = 0
+        fixed_time = 0.0
+        id_nodes = 0
+        id_time = 0.0
+        for _, position in positions:
+            def fixed_depth_search():
+                ctx = SearchContext(mode=mode)
+                search_depth(position.copy(), depth, {}, ctx)
+                return ctx.nodes
+            position_nodes, elapsed = best_time(fixed_depth_search, repeat)
+            nodes += position_nodes
+            fixed_time += elapsed
+            result, elapsed = best_time(lambda: iterative_deepening(position, {}, max_depth=depth, tt=TranspositionTable(), mode=mode), repeat)
+            id_nodes += result.nodes
+            id_time += elapsed
+        depths[str(depth)] = {'nodes': nodes, 'time': fixed_time, 'nodes_per_sec': nodes / fixed_time,
+                              'time_to_depth': id_time, 'id_nodes': id_nodes}
+    return depths
+
+def bench_parallel(positions, depth, workers, repeat):
+    rows = {}
+    with RootSearchPool(workers) as pool:
+        pool.search(positions[0][1], 2, {}) # Start the worker processes before timing
+        for name, position in positions:
+            serial, serial_time = best_time(lambda: iterative_deepening(position, {}, max_depth=depth, tt=TranspositionTable()), repeat)
+            def parallel_search():
+                pool.clear() # Fresh worker tables, like the serial search's fresh table
+                return pool.search(position, depth, {})
+            parallel, parallel_time = best_time(parallel_search, repeat)
+            reference = minimax(position.copy(), depth, -math.inf, math.inf, {})
+            rows[name] = {'serial_nodes': serial.nodes, 'serial_time': serial_time, 'parallel_nodes': parallel.nodes,
+                          'parallel_time': parallel_time, 'score': parallel.score,
+                          'move': move_to_text(position, parallel.move) if parallel.move else None,
+                          'same_as_minimax': (parallel.score, parallel.move) == reference}
+    totals = {key: sum(row[key] for row in rows.values()) for key in ('serial_nodes', 'serial_time', 'parallel_nodes', 'parallel_time')}
+    return {
+        'workers': workers,
+        'depth': depth,
+        'positions': rows,
+        **totals,
+        'speedup': totals['serial_time'] / totals['parallel_time'],
+        'node_ratio': totals['parallel_nodes'] / totals['serial_nodes'],
+        'same_as_minimax': all(row['same_as_minimax'] for row in rows.values()),
+    }
+
+def verify_moves(count, seed=0):
+    # Returns a text line for every random position where staged_moves and legal_moves disagree
+    rng = random.Random(seed)
+    mismatches = []
+    for _ in range(count):
+        wk, wp, bk, other = rng.sample(range(64), 4)
+        if rng.random() < 0.1:
+            position = Position(wk, EMPTY, bk, rng.random() < 0.5, other) # Promoted queen
+        else:
+            position = Position(wk, wp, bk, rng.random() < 0.5)
+        moves = legal_moves(position)
+        # Ordering moves as the search would pass them: legal ones and arbitrary (mostly illegal) ones
+        candidates = moves + [(rng.randrange(64), rng.randrange(64)) for _ in range(3)]
+        ctx = SearchContext()
+        ctx.pv = [rng.choice(candidates)]
+        ctx.killers = {0: [rng.choice(candidates), rng.choice(candidates)]}
+        staged = list(staged_moves(position, ctx, 0, rng.choice(candidates + [None])))
+        name = f"wk={position.wk} wp={position.wp} wq={position.wq} bk={position.bk} {'w' if position.white_to_move else 'b'}"
+        if sorted(staged) != sorted(moves) or len(staged) != len(set(staged)):
+            mismatches.append(f"{name}: staged_moves {staged}, legal_moves {sorted(moves)}")
+        for move in candidates:
+            if is_legal_move(position, move) != (move in moves):
+                mismatches.append(f"{name}: is_legal_move{move} is {move not in moves}")
+    return mismatches
+
+def run_benchmarks(max_depth=8, perft_depth=4, repeat=3, modes=('alphabeta',), parallel_workers=None):
+    set_tablebase(None) # Measure the search itself, not tablebase lookups
+    positions = corpus_positions()
+    all_positions = positions + queen_positions()
+    searches = {mode: bench_search(positions, max_depth, repeat, mode) for mode in modes}
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'max_depth': max_depth, 'perft_depth': perft_depth, 'repeat': repeat, 'modes': list(modes)},
+        'perft': bench_perft(positions, perft_depth, repeat),
+        'check_detection': bench_check_detection(all_positions, 2000, repeat),
+        'evaluation': bench_evaluation(positions, 2000, repeat),
+        'search': searches[modes[0]],
+    }
+    if len(modes) > 1:
+        results['search_modes'] = searches
+        results['fastest_mode'] = {depth: min(modes, key=lambda mode: searches[mode][depth]['time_to_depth'])
+                                   for depth in searches[modes[0]]}
+    if parallel_workers:
+        results['parallel'] = bench_parallel(positions, max_depth, parallel_workers, repeat)
+    return results
+
+def comparable_metrics(results):
+    # Flattens the results into {metric: (value, higher_is_better)}
+    metrics = {
+        'perft.nodes_per_sec': (results['perft']['nodes_per_sec'], True),
+        'check_detection.calls_per_sec': (results['check_detection']['calls_per_sec'], True),
+        'evaluation.evals_per_sec': (results['evaluation']['evals_per_sec'], True),
+    }
+    for depth, entry in results['search'].items():
+        if entry['time'] >= MIN_COMPARED_TIME:
+            metrics[f'search.depth{depth}.nodes_per_sec'] = (entry['nodes_per_sec'], True)
+        if entry['time_to_depth'] >= MIN_COMPARED_TIME:
+            metrics[f'search.depth{depth}.time_to_depth'] = (entry['time_to_depth'], False)
+    return metrics
+
+def compare(results, baseline, tolerance):
+    # Returns a list of (metric, baseline value, new value, change, regressed) rows
+    rows = []
+    new_metrics = comparable_metrics(results)
+    for metric, (old_value, higher_is_better) in comparable_metrics(baseline).items():
+        if metric not in new_metrics:
+            continue
+        new_value = new_metrics[metric][0]
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        rows.append((metric, old_value, new_value, change, regressed))
+    if baseline['perft']['nodes'] != results['perft']['nodes']:
+        print("Warning: perft node counts differ from the baseline (move generation changed).", file=sys.stderr)
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark move generation, check detection, evaluation and search.")
+    parser.add_argument('--max-depth', type=int, default=8, help="Deepest search depth to time (default 8)")
+    parser.add_argument('--perft-depth', type=int, default=4, help="Perft depth (default 4)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement, the fastest is kept (default 3)")
+    parser.add_argument('--output', '-o', help="Write the results as JSON to this file (default stdout)")
+    parser.add_argument('--baseline', help="Saved results to compare against")
+    parser.add_argument('--modes', default='alphabeta',
+                        help=f"Comma-separated search modes to time, from {', '.join(SEARCH_MODES)} (default alphabeta)")
+    parser.add_argument('--parallel', type=int, metavar='WORKERS',
+                        help="Also time parallel root search with this many workers against serial search")
+    parser.add_argument('--verify-moves', type=int, metavar='N',
+                        help="Only check staged move generation against legal_moves on N random positions")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for --verify-moves (default 0)")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="Allowed slowdown before failing (default 0.10)")
+    args = parser.parse_args(argv)
+    modes = tuple(args.modes.split(','))
+    for mode in modes:
+        if mode not in SEARCH_MODES:
+            parser.error(f"unknown search mode '{mode}'")
+    if args.verify_moves is not None:
+        mismatches = verify_moves(args.verify_moves, args.seed)
+        for line in mismatches[:20]:
+            print(line, file=sys.stderr)
+        print(f"{args.verify_moves} positions, {len(mismatches)} mismatches")
+        sys.exit(1 if mismatches else 0)
+
+    results = run_benchmarks(args.max_depth, args.perft_depth, args.repeat, modes, args.parallel)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if 'parallel' in results and not results['parallel']['same_as_minimax']:
+        print("Parallel root search differs from minimax (see 'same_as_minimax').", file=sys.stderr)
+        sys.exit(1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        for metric, old_value, new_value, change, regressed in rows:
+            flag = 'REGRESSION' if regressed else ''
+            print(f"{metric:40} {old_value:14.4f} {new_value:14.4f} {change:+8.1%} {flag}", file=sys.stderr)
+        if any(row[4] for row in rows):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
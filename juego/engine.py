@@ -0,0 +1,965 @@
+import os
+import json
+import math
+import logging
+import logging.handlers
+import random
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from tablebase import KPKTablebase, WIN_BASE, LOSS_BASE, ILLEGAL
+from evaluation import EVAL_TABLE, static_score
+from tables import KING_MOVES, KING_MOVES_TOWARD, KING_ADJACENT, KING_DISTANCE, PAWN_PUSHES, PAWN_CAPTURES, SQUARES_BETWEEN
+
+# Rules, evaluation and search for the King & Pawn vs King game.
+# This module has no pygame dependency: the protocol engine in protocol.py, the GUI in chess.py
+# (for the rules), batch jobs and worker processes all import it directly.
+
+
+EMPTY = -1 # Square index of a piece that is not on the board
+WHITE_PAWN_CAPTURES = PAWN_CAPTURES['W']
+
+# Zobrist keys: one random 64-bit number per (piece, square), plus one for Black to move.
+# The generator is seeded so hashes are identical across runs and processes.
+_zobrist_rng = random.Random(20240601)
+ZOBRIST_WK = [_zobrist_rng.getrandbits(64) for _ in range(64)]
+ZOBRIST_WP = [_zobrist_rng.getrandbits(64) for _ in range(64)]
+ZOBRIST_WQ = [_zobrist_rng.getrandbits(64) for _ in range(64)] # Promoted pawn hashes differently from the pawn
+ZOBRIST_BK = [_zobrist_rng.getrandbits(64) for _ in range(64)]
+ZOBRIST_BLACK_TO_MOVE = _zobrist_rng.getrandbits(64)
+
+class Position:
+    # Compact board used by the rules and the search.
+    # Each piece is stored as a square index (row * 8 + col), EMPTY when it is not on the board.
+    # Moves are (from_sq, to_sq) pairs and are applied in place with make_move/unmake_move,
+    # which also keep the Zobrist hash up to date with a few XORs.
+    __slots__ = ('wk', 'wp', 'wq', 'bk', 'white_to_move', 'hash')
+
+    def __init__(self, wk, wp, bk, white_to_move=True, wq=EMPTY):
+        self.wk = wk
+        self.wp = wp
+        self.wq = wq
+        self.bk = bk
+        self.white_to_move = white_to_move
+        self.hash = self.compute_hash()
+
+    @classmethod
+    def from_pieces(cls, pieces, white_to_move=True):
+        # Builds a Position from the GUI's {(row, col): (color, type)} dictionary
+        squares = {'WK': EMPTY, 'WP': EMPTY, 'WQ': EMPTY, 'BK': EMPTY}
+        for (r, c), (color, piece_type) in pieces.items():
+            squares[color + piece_type] = r * 8 + c
+        return cls(squares['WK'], squares['WP'], squares['BK'], white_to_move, squares['WQ'])
+
+    def to_pieces(self):
+        pieces = {}
+        for sq, piece in ((self.wk, ('W', 'K')), (self.wp, ('W', 'P')), (self.wq, ('W', 'Q')), (self.bk, ('B', 'K'))):
+            if sq != EMPTY:
+                pieces[divmod(sq, 8)] = piece
+        return pieces
+
+    def copy(self):
+        return Position(self.wk, self.wp, self.bk, self.white_to_move, self.wq)
+
+    def compute_hash(self):
+        # Zobrist hash from scratch (make_move updates it incrementally instead)
+        h = 0 if self.white_to_move else ZOBRIST_BLACK_TO_MOVE
+        if self.wk != EMPTY: h ^= ZOBRIST_WK[self.wk]
+        if self.wp != EMPTY: h ^= ZOBRIST_WP[self.wp]
+        if self.wq != EMPTY: h ^= ZOBRIST_WQ[self.wq]
+        if self.bk != EMPTY: h ^= ZOBRIST_BK[self.bk]
+        return h
+
+    def make_move(self, move):
+        # Plays move in place and returns the information unmake_move needs to take it back
+        from_sq, to_sq = move
+        undo = (self.wk, self.wp, self.wq, self.bk, self.hash)
+        h = self.hash ^ ZOBRIST_BLACK_TO_MOVE
+        if self.white_to_move:
+            if to_sq == self.bk: self.bk = EMPTY; h ^= ZOBRIST_BK[to_sq] # Captures
+            if from_sq == self.wk:
+                self.wk = to_sq; h ^= ZOBRIST_WK[from_sq] ^ ZOBRIST_WK[to_sq]
+            elif from_sq == self.wp:
+                if to_sq < 8: # Pawn reaches row 0 and promotes to a Queen
+                    self.wp = EMPTY; self.wq = to_sq; h ^= ZOBRIST_WP[from_sq] ^ ZOBRIST_WQ[to_sq]
+                else:
+                    self.wp = to_sq; h ^= ZOBRIST_WP[from_sq] ^ ZOBRIST_WP[to_sq]
+            elif from_sq == self.wq:
+                self.wq = to_sq; h ^= ZOBRIST_WQ[from_sq] ^ ZOBRIST_WQ[to_sq]
+        else:
+            if to_sq == self.wp: self.wp = EMPTY; h ^= ZOBRIST_WP[to_sq] # Captures
+            elif to_sq == self.wq: self.wq = EMPTY; h ^= ZOBRIST_WQ[to_sq]
+            elif to_sq == self.wk: self.wk = EMPTY; h ^= ZOBRIST_WK[to_sq]
+            self.bk = to_sq; h ^= ZOBRIST_BK[from_sq] ^ ZOBRIST_BK[to_sq]
+        self.hash = h
+        self.white_to_move = not self.white_to_move
+        return undo
+
+    def unmake_move(self, undo):
+        self.wk, self.wp, self.wq, self.bk, self.hash = undo
+        self.white_to_move = not self.white_to_move
+
+def square_to_coords(sq):
+    # Converts a square index back to board coordinates (row, column)
+    return divmod(sq, 8)
+
+FILES = 'abcdefgh'
+
+def square_name(sq):
+    # Algebraic name of a square: row 0 is rank 8, column 0 is file a
+    r, c = divmod(sq, 8)
+    return FILES[c] + str(8 - r)
+
+def parse_square(name):
+    # Square index of an algebraic name such as 'e4'; raises ValueError if it is not a square
+    if len(name) != 2 or name[0] not in FILES or name[1] not in '12345678':
+        raise ValueError(f"Invalid square '{name}'")
+    return (8 - int(name[1])) * 8 + FILES.index(name[0])
+
+def move_to_text(position, move):
+    # Long algebraic notation of a move ('e7e8q' for a promotion)
+    from_sq, to_sq = move
+    text = square_name(from_sq) + square_name(to_sq)
+    if from_sq == position.wp and to_sq < 8:
+        text += 'q'
+    return text
+
+def parse_move(text):
+    # (from_sq, to_sq) of a move in long algebraic notation; a promotion suffix is accepted and ignored
+    if len(text) not in (4, 5) or (len(text) == 5 and text[4] != 'q'):
+        raise ValueError(f"Invalid move '{text}'")
+    return parse_square(text[0:2]), parse_square(text[2:4])
+
+def parse_fen(fen):
+    # Builds a Position from a FEN (or EPD) string. Only the piece placement and side to move
+    # fields are used; the board may only hold K, P, Q (White) and k (Black).
+    fields = fen.split()
+    if len(fields) < 2 or fields[1] not in ('w', 'b'):
+        raise ValueError(f"Invalid FEN '{fen}'")
+    ranks = fields[0].split('/')
+    if len(ranks) != 8:
+        raise ValueError(f"Invalid FEN '{fen}'")
+    squares = {}
+    for r, rank in enumerate(ranks):
+        c = 0
+        for char in rank:
+            if char.isdigit():
+                c += int(char)
+                continue
+            if char not in 'KPQk' or char in squares or c > 7:
+                raise ValueError(f"Unsupported piece placement in FEN '{fen}'")
+            squares[char] = r * 8 + c
+            c += 1
+        if c != 8:
+            raise ValueError(f"Invalid FEN '{fen}'")
+    if 'K' not in squares or 'k' not in squares:
+        raise ValueError(f"FEN '{fen}' needs both kings")
+    return Position(squares['K'], squares.get('P', EMPTY), squares['k'], fields[1] == 'w', squares.get('Q', EMPTY))
+
+def position_to_fen(position):
+    board = [['' for _ in range(8)] for _ in range(8)]
+    for sq, char in ((position.wk, 'K'), (position.wp, 'P'), (position.wq, 'Q'), (position.bk, 'k')):
+        if sq != EMPTY:
+            board[sq // 8][sq % 8] = char
+    ranks = []
+    for row in board:
+        rank, empty = '', 0
+        for char in row:
+            if char:
+                rank += (str(empty) if empty else '') + char
+                empty = 0
+            else:
+                empty += 1
+        ranks.append(rank + (str(empty) if empty else ''))
+    return '/'.join(ranks) + (' w' if position.white_to_move else ' b') + ' - - 0 1'
+
+def validate_position(position):
+    # Raises ValueError if the position cannot occur in a game
+    if position.wk == EMPTY or position.bk == EMPTY:
+        raise ValueError("Both kings must be on the board")
+    if position.wp != EMPTY and not 8 <= position.wp < 56:
+        raise ValueError("The pawn cannot be on the first or last rank")
+    if king_distance(position.wk, position.bk) <= 1:
+        raise ValueError("The kings cannot be next to each other")
+    if in_check(position, not position.white_to_move):
+        raise ValueError("The side that just moved is in check")
+
+def parse_position_line(line):
+    # Parses a FEN/EPD record, or three squares for WK, WP and BK with an optional side to move ("e1 d2 e6 w")
+    fields = line.split()
+    if '/' in fields[0]:
+        position = parse_fen(line)
+    else:
+        if len(fields) not in (3, 4) or (len(fields) == 4 and fields[3] not in ('w', 'b')):
+            raise ValueError(f"Expected 'wk wp bk [w|b]', got '{line}'")
+        wk, wp, bk = (parse_square(name) for name in fields[:3])
+        if len({wk, wp, bk}) != 3:
+            raise ValueError("Two pieces on the same square")
+        position = Position(wk, wp, bk, len(fields) == 3 or fields[3] == 'w')
+    validate_position(position)
+    return position
+
+def board_to_hashable(pieces, white_to_move=True):
+    # Zobrist hash of a pieces dictionary with the given side to move, the same value
+    # Position.hash holds during the search. Used to count repeated positions in the game history.
+    return Position.from_pieces(pieces, white_to_move).hash
+
+# KPK tablebase installed with set_tablebase(). While it is None the AI relies on search only.
+TABLEBASE = None
+
+def set_tablebase(tablebase):
+    global TABLEBASE
+    TABLEBASE = tablebase
+
+def tablebase_score(position):
+    # Exact score of the position from the tablebase (minimax scale), or None if it is not covered
+    if TABLEBASE is None or position.wq != EMPTY or position.wp == EMPTY or position.wk == EMPTY or position.bk == EMPTY:
+        return None
+    value = TABLEBASE.probe(position.wk, position.wp, position.bk, position.white_to_move)
+    if value == ILLEGAL:
+        return None
+    if WIN_BASE <= value < LOSS_BASE:
+        return 100000 - (value - WIN_BASE) # Faster wins score higher
+    if value >= LOSS_BASE:
+        return -200000 + (value - LOSS_BASE) # Slower losses score higher
+    return 0
+
+def tablebase_best_move(position):
+    # Perfect move for the side to move from the tablebase as (from_sq, to_sq), or None if the position is not covered
+    if tablebase_score(position) is None:
+        return None
+    result = TABLEBASE.best_move(position.wk, position.wp, position.bk, position.white_to_move)
+    if result is None:
+        return None
+    from_sq, to_sq, _ = result
+    return from_sq, to_sq
+
+def king_distance(a, b):
+    # Number of king steps between two squares
+    return KING_DISTANCE[a][b]
+
+def get_pawn_moves(position):
+    # Gets the possible moves for the white pawn (moves upwards, decreasing row)
+    moves = []
+    occupied = (position.wk, position.wq, position.bk)
+    for to_sq in PAWN_PUSHES['W'][position.wp]: # One step, then two from the starting row
+        if to_sq in occupied: break
+        moves.append(to_sq)
+    if position.bk in WHITE_PAWN_CAPTURES[position.wp]: # Captures (diagonally forward)
+        moves.append(position.bk)
+    return moves
+
+def queen_attacks(position, target):
+    # Checks if the white queen attacks target along a clear line
+    between = SQUARES_BETWEEN[position.wq][target]
+    if between is None:
+        return False
+    return position.wk not in between and position.wp not in between and position.bk not in between
+
+def in_check(position, white_king):
+    # Checks if the white (white_king=True) or black king is in check
+    if white_king:
+        if position.wk == EMPTY: return True # Should not happen if king is on board
+        return position.bk in KING_ADJACENT[position.wk]
+    bk = position.bk
+    if bk == EMPTY: return True
+    if position.wk != EMPTY and bk in KING_ADJACENT[position.wk]: return True
+    if position.wp != EMPTY and bk in WHITE_PAWN_CAPTURES[position.wp]: return True # White Pawn attacking Black King
+    if position.wq != EMPTY and queen_attacks(position, bk): return True # Queen (result of promotion)
+    return False # Not in check
+
+def legal_moves(position):
+    # Generates all legal moves for the side to move.
+    # Legality is decided with table lookups on the destination square instead of playing each move.
+    wk, wp, wq, bk = position.wk, position.wp, position.wq, position.bk
+    moves = []
+    if position.white_to_move:
+        if wk == EMPTY:
+            return moves # Should not happen if king is on board
+        bk_zone = KING_ADJACENT[bk] if bk != EMPTY else ()
+        for to_sq in KING_MOVES[wk]:
+            if to_sq != wp and to_sq != wq and to_sq not in bk_zone: # Never next to the Black King
+                moves.append((wk, to_sq))
+        if wp != EMPTY and wk not in bk_zone: # Only white pawns for the AI; pawn moves never expose the king
+            moves += [(wp, to_sq) for to_sq in get_pawn_moves(position)]
+        elif wp != EMPTY and bk in WHITE_PAWN_CAPTURES[wp]:
+            moves.append((wp, bk)) # Capturing the Black King is the only way out
+    elif bk != EMPTY:
+        for to_sq in KING_MOVES[bk]:
+            # Pieces captured by this move no longer attack anything
+            if to_sq != wk and wk != EMPTY and to_sq in KING_ADJACENT[wk]: continue
+            if to_sq != wp and wp != EMPTY and to_sq in WHITE_PAWN_CAPTURES[wp]: continue
+            if to_sq != wq and wq != EMPTY:
+                between = SQUARES_BETWEEN[wq][to_sq]
+                if between is not None and wk not in between and wp not in between: continue # bk has left its square
+            moves.append((bk, to_sq))
+    return moves
+
+# Single-move versions of the legality rules in legal_moves, for moves generated one at a time
+def white_king_move_is_legal(position, to_sq):
+    # The White King cannot take its own pieces or step next to the Black King
+    return to_sq != position.wp and to_sq != position.wq and (position.bk == EMPTY or to_sq not in KING_ADJACENT[position.bk])
+
+def pawn_move_is_legal(position, to_sq):
+    # Pawn moves leave the White King where it is: next to the Black King only capturing it is legal
+    return position.bk == EMPTY or position.wk not in KING_ADJACENT[position.bk] or to_sq == position.bk
+
+def black_king_move_is_legal(position, to_sq):
+    wk, wp, wq = position.wk, position.wp, position.wq
+    if to_sq != wk and wk != EMPTY and to_sq in KING_ADJACENT[wk]: return False
+    if to_sq != wp and wp != EMPTY and to_sq in WHITE_PAWN_CAPTURES[wp]: return False
+    if to_sq != wq and wq != EMPTY:
+        between = SQUARES_BETWEEN[wq][to_sq]
+        if between is not None and wk not in between and wp not in between: return False
+    return True
+
+def is_legal_move(position, move):
+    # Checks a move from outside the generator (transposition table, killers) against the position
+    from_sq, to_sq = move
+    if position.white_to_move:
+        if from_sq == position.wk and position.wk != EMPTY:
+            return to_sq in KING_ADJACENT[from_sq] and white_king_move_is_legal(position, to_sq)
+        if from_sq == position.wp and position.wp != EMPTY:
+            return to_sq in get_pawn_moves(position) and pawn_move_is_legal(position, to_sq)
+        return False
+    return (from_sq == position.bk and position.bk != EMPTY and to_sq in KING_ADJACENT[from_sq]
+            and black_king_move_is_legal(position, to_sq))
+
+def is_in_check(pieces, king_color_char):
+    # Checks if the king of 'king_color_char' color is in check (pieces dictionary version)
+    return in_check(Position.from_pieces(pieces), king_color_char == 'W')
+
+def generate_legal_moves(current_pieces, side_to_move_char):
+    # Generates all legal moves for the side_to_move_char side as ((r, c), (r, c)) pairs (pieces dictionary version)
+    position = Position.from_pieces(current_pieces, side_to_move_char == 'W')
+    return [(square_to_coords(from_sq), square_to_coords(to_sq)) for from_sq, to_sq in legal_moves(position)]
+
+def game_result(position, game_board_history):
+    # End-of-game rules, applied to the position the side to move has to play from.
+    # Returns None while the game goes on, otherwise (winner, reason): winner is 'W', 'B' or None for a
+    # draw, reason is 'promotion', 'pawn_captured', 'repetition', 'checkmate' or 'stalemate'.
+    # The game always starts with the pawn, so a missing pawn means it has been captured.
+    if position.wq != EMPTY or (position.wp != EMPTY and position.wp < 8):
+        return 'W', 'promotion'
+    if position.wp == EMPTY:
+        return 'B', 'pawn_captured'
+    if game_board_history.get(position.hash, 0) >= 3:
+        return None, 'repetition'
+    if not legal_moves(position):
+        if in_check(position, position.white_to_move):
+            return ('B' if position.white_to_move else 'W'), 'checkmate'
+        return None, 'stalemate'
+    return None
+
+def evaluate_board(position, game_board_history):
+    # Evaluates the board from White's perspective.
+    
+    # If this board state, if played, would be the third repetition, consider it a draw.
+    if game_board_history.get(position.hash, 0) >= 2: # This move would make it the 3rd time
+        return 0 # Draw score
+
+    if position.wq != EMPTY:
+        return 100000  # White pawn promoted - Win for White
+
+    if position.wp == EMPTY: # The game always starts with the pawn, so it has been captured
+         return -200000 # Even greater penalty for losing the pawn.
+
+    if position.wk == EMPTY or position.bk == EMPTY: # Not a real game position, not covered by the table
+        return static_score(position.wk, position.wp, position.bk)
+    return EVAL_TABLE[(position.wk * 64 + position.wp) * 64 + position.bk]
+
+# Deepest ply at which minimax uses the persistent position cache (each probe is a database lookup)
+CACHE_MAX_PLY = 3
+
+# Search algorithms selectable in iterative_deepening:
+#   alphabeta  full-window alpha-beta at every node
+#   pvs        principal variation search: the first move gets the full window, the others a null
+#              window that only proves they are no better, re-searched when that proof fails
+#   mtdf       MTD(f): a sequence of null-window searches converging on the score, with the
+#              transposition table remembering the bounds found by earlier passes
+SEARCH_MODES = ('alphabeta', 'pvs', 'mtdf')
+
+# Bound types stored in transposition table entries
+TT_EXACT, TT_LOWER, TT_UPPER = 0, 1, 2
+
+class TranspositionTable:
+    # Caches minimax results keyed by the position's Zobrist hash (which includes the side to move).
+    # Each entry is (depth, score, bound_type, best_move). The table holds at most
+    # max_entries positions: an existing entry is only overwritten by a search that is
+    # at least as deep, and when the table is full the oldest stored entry is evicted.
+    def __init__(self, max_entries=200000):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.replacements = 0
+        self.evictions = 0
+
+    def probe(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def store(self, key, depth, score, bound_type, best_move):
+        old_entry = self.entries.get(key)
+        if old_entry is not None:
+            if depth < old_entry[0]: # Keep the deeper result
+                return
+            self.replacements += 1
+        elif len(self.entries) >= self.max_entries:
+            del self.entries[next(iter(self.entries))] # Evict the oldest entry (dicts keep insertion order)
+            self.evictions += 1
+        self.entries[key] = (depth, score, bound_type, best_move)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'replacements': self.replacements,
+            'evictions': self.evictions,
+        }
+
+
+class SearchTimeout(Exception):
+    # Raised inside minimax when the time or node budget of the current search runs out
+    pass
+
+class SearchStats:
+    # Counters collected during one search when statistics are enabled
+    def __init__(self):
+        self.leaf_evaluations = 0
+        self.tablebase_hits = 0
+        self.tt_hits = 0 # Probes that found an entry
+        self.cache_hits = 0 # Entries that came from the persistent position cache
+        self.tt_cutoffs = 0 # Entries good enough to return without searching
+        self.interior_nodes = 0 # Nodes whose moves were generated and searched
+        self.moves_searched = 0
+        self.beta_cutoffs = 0
+        self.cutoff_move_index = {} # Index of the move that caused the cutoff (0 = first move tried) -> count
+        self.iterations = [] # One entry per completed depth of iterative deepening
+
+    def to_dict(self):
+        first_move_cutoffs = self.cutoff_move_index.get(0, 0)
+        return {
+            'leaf_evaluations': self.leaf_evaluations,
+            'tablebase_hits': self.tablebase_hits,
+            'tt_hits': self.tt_hits,
+            'cache_hits': self.cache_hits,
+            'tt_cutoffs': self.tt_cutoffs,
+            'beta_cutoffs': self.beta_cutoffs,
+            'first_move_cutoff_rate': first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else None,
+            'cutoff_move_index': {str(index): count for index, count in sorted(self.cutoff_move_index.items())},
+            'branching_factor': self.moves_searched / self.interior_nodes if self.interior_nodes else None,
+            'iterations': self.iterations,
+        }
+
+class SearchContext:
+    # State shared by every node of one search: transposition table, limits and move ordering data
+    def __init__(self, tt=None, deadline=None, node_limit=None, stop_event=None, stats=None, cache=None, mode='alphabeta', exact_depth=False):
+        self.tt = tt
+        # Only cut off on table entries of exactly the searched depth. Scores then equal plain minimax
+        # (a deeper entry can hold a different score), at the cost of fewer cutoffs.
+        self.exact_depth = exact_depth
+        self.mode = mode # One of SEARCH_MODES; 'pvs' makes minimax search later moves with a null window first
+        self.cache = cache # poscache.PositionCache probed and filled near the root, or None
+        self.stats = stats # SearchStats to fill in, or None to skip the bookkeeping
+        self.deadline = deadline # time.perf_counter() value at which the search stops, or None
+        self.node_limit = node_limit
+        self.stop_event = stop_event # threading.Event that cancels the search when set
+        self.limits_active = False # The driver only enforces limits once a first iteration has completed
+        self.nodes = 0
+        self.killers = {} # ply -> up to two quiet moves that caused a beta cutoff there
+        self.pv = [] # Principal variation of the last completed iteration
+        self.pv_table = {} # ply -> best line found from that ply in the current iteration
+
+    def count_node(self):
+        self.nodes += 1
+        if self.stop_event is not None and self.nodes % 512 == 0 and self.stop_event.is_set():
+            raise SearchTimeout()
+        if self.limits_active:
+            if self.node_limit is not None and self.nodes >= self.node_limit:
+                raise SearchTimeout()
+            if self.deadline is not None and self.nodes % 512 == 0 and time.perf_counter() >= self.deadline:
+                raise SearchTimeout()
+
+def staged_moves(position, ctx, ply, tt_move):
+    # Yields the legal moves of the side to move in stages, the likeliest cutoffs first:
+    #   1. previous principal variation move, transposition table move, killers
+    #   2. White: pawn promotion and pushes, then pawn captures; Black: king captures
+    #   3. king moves, closest to the pawn first
+    # Each move is checked for legality only when its turn comes, so nothing is spent on the
+    # moves after a cutoff. The position must be restored before the next move is requested.
+    tried = []
+    pv_move = ctx.pv[ply] if ply < len(ctx.pv) else None
+    for move in (pv_move, tt_move, *ctx.killers.get(ply, ())):
+        if move is not None and move not in tried and is_legal_move(position, move):
+            tried.append(move)
+            yield move
+
+    wk, wp, wq, bk = position.wk, position.wp, position.wq, position.bk
+    if position.white_to_move:
+        if wk == EMPTY:
+            return
+        if wp != EMPTY:
+            if bk == EMPTY or wk not in KING_ADJACENT[bk]: # Next to the Black King only the capture is legal
+                for to_sq in PAWN_PUSHES['W'][wp]: # Promotion or single push, then the double push
+                    if to_sq == wk or to_sq == wq or to_sq == bk: break
+                    if (wp, to_sq) not in tried: yield wp, to_sq
+            if bk in WHITE_PAWN_CAPTURES[wp] and (wp, bk) not in tried:
+                yield wp, bk
+        for to_sq in KING_MOVES_TOWARD[wk][wp] if wp != EMPTY else KING_MOVES[wk]:
+            if (wk, to_sq) not in tried and white_king_move_is_legal(position, to_sq):
+                yield wk, to_sq
+    elif bk != EMPTY:
+        targets = KING_MOVES_TOWARD[bk][wp] if wp != EMPTY else KING_MOVES[bk]
+        captures = [to_sq for to_sq in targets if to_sq == wp or to_sq == wq or to_sq == wk]
+        for to_sq in captures + [to_sq for to_sq in targets if to_sq not in captures]:
+            if (bk, to_sq) not in tried and black_king_move_is_legal(position, to_sq):
+                yield bk, to_sq
+
+def record_cutoff(ctx, ply, move, position, move_index):
+    # Remembers a move that refuted the opponent so it is tried early elsewhere
+    if ctx.stats is not None:
+        ctx.stats.beta_cutoffs += 1
+        ctx.stats.cutoff_move_index[move_index] = ctx.stats.cutoff_move_index.get(move_index, 0) + 1
+    if move[1] not in (position.wk, position.wp, position.bk): # Quiet move (not a capture)
+        killers = ctx.killers.setdefault(ply, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
+
+def minimax(position, depth, alpha, beta, game_board_history, ctx=None, ply=0):
+    # Minimax algorithm with Alpha-Beta pruning
+    # The position is modified in place while searching and restored before returning.
+    # ctx: optional SearchContext (transposition table, limits, move ordering) shared by the search
+    stats = None
+    if ctx is not None:
+        ctx.count_node()
+        ctx.pv_table[ply] = []
+        stats = ctx.stats
+    
+    if position.wq != EMPTY:
+        return 100000, None 
+    
+    if position.wp == EMPTY: # Pawn captured
+         return -200000, None 
+
+    # Positions covered by the tablebase are solved exactly, no need to search them
+    tb_score = tablebase_score(position)
+    if tb_score is not None:
+        if stats is not None: stats.tablebase_hits += 1
+        if game_board_history.get(position.hash, 0) >= 2:
+            return 0, None # Would be the third repetition
+        return tb_score, None
+
+    # Repetition check for leaf nodes or pre-terminal states
+    if depth == 0:
+        if stats is not None: stats.leaf_evaluations += 1
+        return evaluate_board(position, game_board_history), None
+
+    is_maximizing_white_turn = position.white_to_move
+
+    tt = ctx.tt if ctx is not None else None
+    cache = ctx.cache if ctx is not None and ply <= CACHE_MAX_PLY else None # Persistent cache, near the root only
+    tt_key = position.hash
+    tt_move = None
+    entry = tt.probe(tt_key) if tt is not None else None
+    if cache is not None and (entry is None or entry[0] < depth):
+        cached_entry = cache.probe(tt_key)
+        if cached_entry is not None and (entry is None or cached_entry[0] > entry[0]):
+            if stats is not None: stats.cache_hits += 1
+            entry = cached_entry
+    if entry is not None:
+        if stats is not None: stats.tt_hits += 1
+        entry_depth, entry_score, entry_bound, tt_move = entry
+        if entry_depth == depth or (entry_depth > depth and not ctx.exact_depth):
+            if entry_bound == TT_EXACT or (entry_bound == TT_LOWER and entry_score >= beta) or (entry_bound == TT_UPPER and entry_score <= alpha):
+                if stats is not None: stats.tt_cutoffs += 1
+                if tt_move is not None: ctx.pv_table[ply] = [tt_move]
+                return entry_score, tt_move
+    alpha_orig, beta_orig = alpha, beta
+
+    # With a search context moves are produced lazily, best candidates first
+    possible_next_moves = staged_moves(position, ctx, ply, tt_move) if ctx is not None else legal_moves(position)
+
+    best_move_found = None
+    move_index = -1
+    pvs = ctx is not None and ctx.mode == 'pvs'
+
+    if is_maximizing_white_turn: # White's turn (AI)
+        best_eval = -math.inf
+        for move_index, move in enumerate(possible_next_moves):
+            undo = position.make_move(move)
+            if pvs and move_index > 0 and alpha > -math.inf:
+                # Null window: only prove this move is no better than alpha (scores are integers)
+                eval_score, _ = minimax(position, depth - 1, alpha, alpha + 1, game_board_history, ctx, ply + 1)
+                if alpha < eval_score < beta: # It is better after all, get its real score
+                    eval_score, _ = minimax(position, depth - 1, alpha, beta, game_board_history, ctx, ply + 1)
+            else:
+                eval_score, _ = minimax(position, depth - 1, alpha, beta, game_board_history, ctx, ply + 1)
+            position.unmake_move(undo)
+            
+            if eval_score > best_eval:
+                best_eval = eval_score
+                best_move_found = move
+                if ctx is not None: ctx.pv_table[ply] = [move] + ctx.pv_table.get(ply + 1, [])
+            alpha = max(alpha, eval_score)
+            if beta <= alpha:
+                if ctx is not None: record_cutoff(ctx, ply, move, position, move_index)
+                break
+    else: # Black's turn (Human)
+        best_eval = math.inf
+        for move_index, move in enumerate(possible_next_moves):
+            undo = position.make_move(move)
+            if pvs and move_index > 0 and beta < math.inf:
+                eval_score, _ = minimax(position, depth - 1, beta - 1, beta, game_board_history, ctx, ply + 1)
+                if alpha < eval_score < beta:
+                    eval_score, _ = minimax(position, depth - 1, alpha, beta, game_board_history, ctx, ply + 1)
+            else:
+                eval_score, _ = minimax(position, depth - 1, alpha, beta, game_board_history, ctx, ply + 1)
+            position.unmake_move(undo)
+
+            if eval_score < best_eval:
+                best_eval = eval_score
+                best_move_found = move
+                if ctx is not None: ctx.pv_table[ply] = [move] + ctx.pv_table.get(ply + 1, [])
+            beta = min(beta, eval_score)
+            if beta <= alpha:
+                if ctx is not None: record_cutoff(ctx, ply, move, position, move_index)
+                break
+    if move_index < 0: # No legal moves
+        if in_check(position, is_maximizing_white_turn):
+            return (-90000 if is_maximizing_white_turn else 90000), None # Checkmate
+        else:
+            # A stalemate is a draw, score 0. Evaluate_board might also return 0 if it's a repeated position.
+            return 0, None # Stalemate
+    if stats is not None:
+        stats.interior_nodes += 1
+        stats.moves_searched += move_index + 1
+    if tt is not None or cache is not None:
+        bound_type = tt_bound_type(best_eval, alpha_orig, beta_orig)
+        if tt is not None: tt.store(tt_key, depth, best_eval, bound_type, best_move_found)
+        if cache is not None: cache.store(tt_key, depth, best_eval, bound_type, best_move_found)
+    return best_eval, best_move_found
+
+def tt_bound_type(score, alpha_orig, beta_orig):
+    # Classifies a search result against the window it was searched with
+    if score <= alpha_orig:
+        return TT_UPPER # Fail low: the real score is at most this
+    if score >= beta_orig:
+        return TT_LOWER # Fail high: the real score is at least this
+    return TT_EXACT
+
+def mtdf(position, depth, first_guess, game_board_history, ctx):
+    # MTD(f): null-window minimax searches around a guess until the lower and upper bounds meet.
+    # Needs a transposition table to remember the bounds between passes (one is created if ctx has none).
+    if ctx.tt is None:
+        ctx.tt = TranspositionTable()
+    maximizing = position.white_to_move
+    score, best_move, best_pv = first_guess, None, []
+    lower, upper = -math.inf, math.inf
+    while lower < upper:
+        beta = score + 1 if score == lower else score
+        score, move = minimax(position, depth, beta - 1, beta, game_board_history, ctx)
+        if score < beta:
+            upper = score
+        else:
+            lower = score
+        # The move of a pass that proved a bound in the side to move's favour is a real best move
+        proved = score >= beta if maximizing else score < beta
+        if move is not None and (proved or best_move is None):
+            best_move, best_pv = move, ctx.pv_table.get(0, [])
+    ctx.pv_table[0] = best_pv
+    return score, best_move
+
+def search_depth(position, depth, game_board_history, ctx, guess=0):
+    # One fixed-depth search from the root with the algorithm selected by ctx.mode
+    if ctx.mode == 'mtdf':
+        return mtdf(position, depth, guess, game_board_history, ctx)
+    return minimax(position, depth, -math.inf, math.inf, game_board_history, ctx)
+
+class SearchResult:
+    # Outcome of a search: best move from the last completed depth
+    def __init__(self, score, move, depth, nodes, pv, elapsed, worker_nodes=None, stats=None):
+        self.score = score
+        self.move = move
+        self.depth = depth # Last fully searched depth (0 for a tablebase move)
+        self.nodes = nodes
+        self.pv = pv
+        self.elapsed = elapsed
+        self.worker_nodes = worker_nodes or {} # Process id -> nodes searched there (parallel search only)
+        self.stats = stats # SearchStats when statistics were collected
+
+    def to_dict(self, position=None):
+        # JSON-ready summary; moves are written in algebraic notation when the searched position is given
+        def move_text(board, move):
+            return move_to_text(board, move) if board is not None else list(move)
+        pv_text = []
+        board = position.copy() if position is not None else None
+        for move in self.pv:
+            pv_text.append(move_text(board, move))
+            if board is not None: board.make_move(move)
+        summary = {
+            'move': move_text(position, self.move) if self.move else None,
+            'score': self.score,
+            'depth': self.depth,
+            'nodes': self.nodes,
+            'time': round(self.elapsed, 6),
+            'nps': round(self.nodes / self.elapsed) if self.elapsed > 0 else None,
+            'pv': pv_text,
+        }
+        if self.stats is not None:
+            summary['stats'] = self.stats.to_dict()
+        return summary
+
+def iterative_deepening(position, game_board_history, max_depth=64, time_limit=None, node_limit=None, tt=None, stop_event=None, collect_stats=False, log=True, cache=None,
+                        mode='alphabeta', on_iteration=None):
+    # Searches depth 1, 2, 3... until max_depth, the time limit (seconds) or the node limit is reached,
+    # and returns the result of the last depth that finished. Depth 1 always completes.
+    # Setting stop_event cancels the search; the result is None if no depth had finished yet.
+    # With collect_stats (or a search log configured) the result carries a SearchStats in result.stats.
+    # log=False keeps the result out of the search log (the caller logs it if it is ever used).
+    # mode selects the search algorithm (see SEARCH_MODES).
+    # on_iteration is called with the SearchResult of every completed depth (protocol info lines).
+    # cache: poscache.PositionCache shared across sessions. It is skipped once a position has repeated,
+    # because cached scores do not account for repetition draws.
+    start_time = time.perf_counter()
+    stats = SearchStats() if collect_stats or SEARCH_LOG.handlers else None
+    tb_move = tablebase_best_move(position)
+    if tb_move is not None:
+        if stats is not None: stats.tablebase_hits += 1
+        result = SearchResult(tablebase_score(position), tb_move, 0, 0, [tb_move], time.perf_counter() - start_time, stats=stats)
+        if on_iteration is not None: on_iteration(result)
+        if log: log_search(position, result)
+        return result
+
+    if cache is not None and any(count >= 2 for count in game_board_history.values()):
+        cache = None
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{mode}'")
+    ctx = SearchContext(tt, None if time_limit is None else start_time + time_limit, node_limit, stop_event, stats, cache, mode)
+    result = None
+    for depth in range(1, max_depth + 1):
+        ctx.limits_active = result is not None
+        iteration_start, iteration_nodes = time.perf_counter(), ctx.nodes
+        try:
+            # Search a copy: an interrupted search leaves its board half-played
+            score, move = search_depth(position.copy(), depth, game_board_history, ctx, result.score if result is not None else 0)
+        except SearchTimeout:
+            break
+        finally:
+            if cache is not None: cache.flush()
+        ctx.pv = ctx.pv_table.get(0, [])
+        result = SearchResult(score, move, depth, ctx.nodes, list(ctx.pv), time.perf_counter() - start_time, stats=stats)
+        if stats is not None:
+            nodes = ctx.nodes - iteration_nodes
+            previous = stats.iterations[-1]['nodes'] if stats.iterations else None
+            stats.iterations.append({
+                'depth': depth,
+                'nodes': nodes,
+                'time': round(time.perf_counter() - iteration_start, 6),
+                'score': score,
+                'effective_branching_factor': nodes / previous if previous else None,
+            })
+        if on_iteration is not None: on_iteration(result)
+        if move is None or score >= 100000 or score <= -200000:
+            break # No legal moves, or a forced promotion/capture that deeper search cannot change
+        if time_limit is not None and time.perf_counter() - start_time >= time_limit:
+            break
+    if result is not None:
+        result.nodes = ctx.nodes
+        result.elapsed = time.perf_counter() - start_time
+        if log: log_search(position, result)
+    return result
+
+# Per-move search statistics log. Nothing is collected or written until configure_search_log() is called.
+SEARCH_LOG = logging.getLogger('kpk.search')
+SEARCH_LOG.propagate = False
+
+def configure_search_log(path, max_bytes=10 * 1024 * 1024, backup_count=5):
+    # Appends one JSON line per AI move to path, rotating the file once it reaches max_bytes
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    SEARCH_LOG.addHandler(handler)
+    SEARCH_LOG.setLevel(logging.INFO)
+
+def log_search(position, result):
+    if not SEARCH_LOG.handlers:
+        return
+    record = result.to_dict(position)
+    record['fen'] = position_to_fen(position)
+    record['timestamp'] = time.time()
+    SEARCH_LOG.info(json.dumps(record))
+
+class Ponderer:
+    # Searches every reply of the side to move on a background thread while the human is thinking.
+    # The search after each reply is the one the engine would run once that reply is played
+    # (same history and search options), so a finished result can be played without searching again.
+    # Unfinished replies still leave their work in the shared transposition table.
+    def __init__(self):
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._results = {} # Zobrist hash of the position after the reply -> SearchResult
+
+    def start(self, position, game_board_history, predicted_move=None, **search_options):
+        # predicted_move (e.g. the reply from the last principal variation) is searched first
+        self.stop()
+        self._results = {}
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(position.copy(), dict(game_board_history), predicted_move, search_options), daemon=True)
+        self._thread.start()
+
+    def _run(self, position, game_board_history, predicted_move, search_options):
+        replies = legal_moves(position)
+        if predicted_move in replies:
+            replies.remove(predicted_move)
+            replies.insert(0, predicted_move)
+        for move in replies:
+            if self._stop_event.is_set():
+                break
+            child = position.copy()
+            child.make_move(move)
+            history = dict(game_board_history)
+            history[child.hash] = history.get(child.hash, 0) + 1
+            options = dict(search_options)
+            if history[child.hash] >= 2:
+                # This reply repeats a position: its scores would not be valid for the other replies,
+                # so it gets a table of its own (protocol.py clears the shared one when it is played)
+                options['tt'] = TranspositionTable()
+            result = iterative_deepening(child, history, stop_event=self._stop_event, log=False, **options)
+            if result is not None and not self._stop_event.is_set():
+                self._results[child.hash] = result
+
+    def busy(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def take(self, position):
+        # Stops pondering and returns the finished SearchResult for position (the one after the
+        # reply actually played), or None if it was not searched in time
+        self.stop()
+        result = self._results.pop(position.hash, None)
+        self._results = {}
+        if result is not None:
+            log_search(position, result)
+        return result
+
+# State of a RootSearchPool worker process, filled in by _init_root_worker
+_root_worker_state = {}
+
+def _init_root_worker(shared_bound, tablebase_path, tt_entries):
+    _root_worker_state['bound'] = shared_bound
+    _root_worker_state['tt'] = TranspositionTable(max_entries=tt_entries)
+    _root_worker_state['generation'] = 0
+    _root_worker_state['repeated'] = frozenset()
+    set_tablebase(KPKTablebase(tablebase_path) if tablebase_path is not None else None)
+
+def _search_root_move(index, position, move, depth, game_board_history, generation, pv=()):
+    # Searches one root move in a worker process with the worker's own transposition table, against
+    # the best score found so far by any worker. The window is widened by one point so a move that
+    # ties the best score still gets an exact value. Table cutoffs use exact depths only, so the
+    # score is the plain minimax one. pv orders the moves below the one searched first.
+    state = _root_worker_state
+    repeated = frozenset(key for key, count in game_board_history.items() if count >= 2)
+    if generation != state['generation'] or repeated != state['repeated']:
+        # A cleared pool, or scores searched with other repetition counts
+        state['tt'].clear()
+        state['generation'], state['repeated'] = generation, repeated
+    shared_bound = state['bound']
+    maximizing = position.white_to_move
+
+    child = position.copy()
+    child.make_move(move)
+    ctx = SearchContext(state['tt'], exact_depth=True)
+    ctx.pv = list(pv)
+    with shared_bound.get_lock():
+        best = shared_bound.value
+    alpha, beta = (best - 1, math.inf) if maximizing else (-math.inf, best + 1)
+    score, _ = minimax(child, depth - 1, alpha, beta, game_board_history, ctx, 1)
+
+    with shared_bound.get_lock():
+        if (score > shared_bound.value) if maximizing else (score < shared_bound.value):
+            shared_bound.value = score
+    return index, score, ctx.nodes, os.getpid(), [move] + ctx.pv_table.get(1, [])
+
+ROOT_ORDER_DEPTH = 4 # Depth of the serial search that picks the root move searched first
+
+class RootSearchPool:
+    # Worker processes for parallel fixed-depth search, started once and reused by every search.
+    # The root moves are split across the workers; each keeps its own transposition table between
+    # searches (clear() forgets them). The workers use the tablebase installed when the pool is created.
+    def __init__(self, workers=None, tt_entries=200000):
+        self.workers = workers or os.cpu_count() or 1
+        self._generation = 0
+        self._bound = multiprocessing.Value('d', 0.0) # Best root score so far, shared by the workers
+        tablebase_path = TABLEBASE.path if TABLEBASE is not None else None
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_root_worker,
+                                         initargs=(self._bound, tablebase_path, tt_entries))
+
+    def clear(self):
+        # Makes the next search start with empty worker tables
+        self._generation += 1
+
+    def search(self, position, depth, game_board_history):
+        # Returns the score and move of minimax(position, depth, -inf, inf, game_board_history): the best
+        # score, and the first move in legal_moves order to reach it. Positions the tablebase covers are
+        # answered from it, as iterative_deepening does. The best move of a shallow serial search is
+        # searched first, alone, so every other root move starts with its score as the bound.
+        start_time = time.perf_counter()
+        tb_move = tablebase_best_move(position)
+        if tb_move is not None:
+            return SearchResult(tablebase_score(position), tb_move, 0, 0, [tb_move], time.perf_counter() - start_time)
+        legal = legal_moves(position)
+        if depth <= 0 or not legal or position.wq != EMPTY or position.wp == EMPTY or tablebase_score(position) is not None:
+            # Terminal, tablebase or leaf position: nothing to split
+            score, move = minimax(position.copy(), depth, -math.inf, math.inf, game_board_history)
+            return SearchResult(score, move, depth, 1, [move] if move else [], time.perf_counter() - start_time)
+
+        order = iterative_deepening(position, game_board_history, max_depth=min(depth - 1, ROOT_ORDER_DEPTH) or 1,
+                                    tt=TranspositionTable(), log=False)
+        moves = list(legal)
+        if order.move in moves:
+            moves.remove(order.move)
+            moves.insert(0, order.move)
+        maximizing = position.white_to_move
+        with self._bound.get_lock():
+            self._bound.value = -math.inf if maximizing else math.inf
+        submit = lambda move, pv=(): self._pool.submit(_search_root_move, legal.index(move), position, move, depth, game_board_history,
+                                                       self._generation, pv)
+        results = [submit(moves[0], order.pv).result()]
+        futures = [submit(move) for move in moves[1:]]
+        results += [future.result() for future in futures]
+
+        results.sort() # Legal move order, so the first best score is the move minimax would pick
+        scores = [score for _, score, _, _, _ in results]
+        best_score = max(scores) if maximizing else min(scores)
+        best_index = scores.index(best_score)
+        worker_nodes = {}
+        for _, _, nodes, pid, _ in results:
+            worker_nodes[pid] = worker_nodes.get(pid, 0) + nodes
+        total_nodes = 1 + order.nodes + sum(worker_nodes.values()) # Root, move ordering and every worker's search
+        return SearchResult(best_score, legal[best_index], depth, total_nodes, results[best_index][4],
+                            time.perf_counter() - start_time, worker_nodes)
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
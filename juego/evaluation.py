@@ -0,0 +1,109 @@
+import os
+from array import array
+
+# Static evaluation of every (WK, WP, BK) placement, precomputed into one flat table.
+# EVAL_TABLE[(wk * 64 + wp) * 64 + bk] is the score from White's perspective. Results that
+# depend on more than the three squares (promotion, captured pawn, repetitions) are handled
+# by evaluate_board in engine.py.
+# The table is built with NumPy when it is installed and cached next to this file. NumPy is only
+# imported to build it, so reading the cache keeps 'import engine' fast in every worker process.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EVAL_TABLE_VERSION = 1 # Bump whenever static_score changes, so stale cache files are rebuilt
+DEFAULT_EVAL_TABLE_PATH = os.path.join(BASE_DIR, f'eval_v{EVAL_TABLE_VERSION}.bin')
+EVAL_TABLE_SIZE = 64 * 64 * 64
+EMPTY = -1
+
+def static_score(wk, wp, bk):
+    # Positional score for a position with the pawn still on the board (wk/bk may be EMPTY)
+    score = 0 # Initial score
+    wp_r, wp_c = divmod(wp, 8)
+    score += (6 - wp_r) * 60
+
+    pawn_is_attacked_by_bk = bk != EMPTY and max(abs(bk // 8 - wp_r), abs(bk % 8 - wp_c)) == 1
+    pawn_is_defended_by_wk = wk != EMPTY and max(abs(wk // 8 - wp_r), abs(wk % 8 - wp_c)) == 1
+
+    if pawn_is_attacked_by_bk and not pawn_is_defended_by_wk:
+        score -= 7000
+    elif pawn_is_defended_by_wk:
+        score += 200
+        if pawn_is_attacked_by_bk:
+            score -= 100
+
+    if wk != EMPTY:
+        wk_r, wk_c = divmod(wk, 8)
+        dist_wk_wp = abs(wk_r - wp_r) + abs(wk_c - wp_c)
+        score -= dist_wk_wp * 15
+
+        if wp_r > 1 and wk_r == wp_r - 1 and wk_c == wp_c:
+            score += 60
+
+    if bk != EMPTY:
+        bk_r, bk_c = divmod(bk, 8)
+        if bk_r < wp_r and abs(bk_c - wp_c) <= 1:
+            score -= 40
+        dist_bk_wp = abs(bk_r - wp_r) + abs(bk_c - wp_c)
+        if dist_bk_wp < 2: score -= 30
+        dist_bk_promo_sq = abs(bk_r - 0) + abs(bk_c - wp_c)
+        score += dist_bk_promo_sq * 3
+
+    if wk != EMPTY and wk // 8 == 7:
+        if not wp // 8 <= 2:
+            score -= 20
+    return score
+
+def build_eval_table_python():
+    return array('i', [static_score(wk, wp, bk) for wk in range(64) for wp in range(64) for bk in range(64)])
+
+def build_eval_table_numpy():
+    # Same terms as static_score, computed for all 64^3 placements at once
+    import numpy as np
+    wk, wp, bk = np.indices((64, 64, 64), dtype=np.int32).reshape(3, -1)
+    wk_r, wk_c = np.divmod(wk, 8)
+    wp_r, wp_c = np.divmod(wp, 8)
+    bk_r, bk_c = np.divmod(bk, 8)
+
+    score = (6 - wp_r) * 60
+    attacked = np.maximum(abs(bk_r - wp_r), abs(bk_c - wp_c)) == 1
+    defended = np.maximum(abs(wk_r - wp_r), abs(wk_c - wp_c)) == 1
+    score -= np.where(attacked & ~defended, 7000, 0)
+    score += np.where(defended, 200, 0) - np.where(defended & attacked, 100, 0)
+
+    score -= (abs(wk_r - wp_r) + abs(wk_c - wp_c)) * 15
+    score += np.where((wp_r > 1) & (wk_r == wp_r - 1) & (wk_c == wp_c), 60, 0)
+
+    score -= np.where((bk_r < wp_r) & (abs(bk_c - wp_c) <= 1), 40, 0)
+    score -= np.where(abs(bk_r - wp_r) + abs(bk_c - wp_c) < 2, 30, 0)
+    score += (bk_r + abs(bk_c - wp_c)) * 3
+
+    score -= np.where((wk_r == 7) & (wp_r > 2), 20, 0)
+    return array('i', score.astype(np.int32).tobytes())
+
+def build_eval_table():
+    try:
+        return build_eval_table_numpy()
+    except ImportError: # NumPy is optional, the table is then built in pure Python
+        return build_eval_table_python()
+
+def load_eval_table(path=DEFAULT_EVAL_TABLE_PATH):
+    # Reads the cached table, or builds it and tries to write the cache (path=None disables caching)
+    if path is not None and os.path.exists(path):
+        table = array('i')
+        try:
+            with open(path, 'rb') as f:
+                table.fromfile(f, EVAL_TABLE_SIZE)
+            return table
+        except (OSError, EOFError):
+            pass # Truncated or unreadable cache, rebuild it
+    table = build_eval_table()
+    if path is not None:
+        try:
+            tmp_path = f'{path}.{os.getpid()}.tmp' # Worker processes may build the table at the same time
+            with open(tmp_path, 'wb') as f:
+                table.tofile(f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass # Read-only install, keep the table in memory only
+    return table
+
+EVAL_TABLE = load_eval_table()
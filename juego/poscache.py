@@ -0,0 +1,97 @@
+import os
+import time
+import sqlite3
+import threading
+from evaluation import EVAL_TABLE_VERSION
+
+# Persistent cache of searched positions, shared by every session and process on the machine.
+# It uses the same (depth, score, bound_type, best_move) entries as the in-memory TranspositionTable,
+# keyed by Zobrist hash, and is stored in an SQLite database in WAL mode so any number of
+# engine processes can read while one writes. Stores are buffered and written by flush().
+# Scores assume no position has repeated yet, so searches with a repetition in their history
+# must not use the cache (iterative_deepening takes care of this).
+# Scores depend on the static evaluation, so the file records the EVAL_TABLE_VERSION it was filled
+# with and is emptied when opened by a different version.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(BASE_DIR, 'positions.sqlite')
+
+def _signed(key):
+    # SQLite integers are signed 64-bit, Zobrist hashes are unsigned
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+class PositionCache:
+    # At most max_entries positions are kept; once the file is over the cap the least recently
+    # stored entries are deleted. An entry is only overwritten by a search at least as deep.
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=1000000, timeout=10.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.pending = {} # key -> entry, not written yet
+        self._lock = threading.Lock() # The GUI searches and ponders from background threads
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS positions (key INTEGER PRIMARY KEY, depth INTEGER, score INTEGER, '
+                             'bound INTEGER, move_from INTEGER, move_to INTEGER, stored REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS positions_stored ON positions (stored)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self._check_version()
+
+    def _check_version(self):
+        with self._db:
+            self._db.execute('BEGIN IMMEDIATE') # Another process may be opening the same file
+            row = self._db.execute("SELECT value FROM meta WHERE name = 'eval_version'").fetchone()
+            if row is None or row[0] != str(EVAL_TABLE_VERSION):
+                self._db.execute('DELETE FROM positions')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('eval_version', ?)", (str(EVAL_TABLE_VERSION),))
+
+    def probe(self, key):
+        with self._lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                row = self._db.execute('SELECT depth, score, bound, move_from, move_to FROM positions WHERE key = ?',
+                                       (_signed(key),)).fetchone()
+                if row is not None:
+                    depth, score, bound, move_from, move_to = row
+                    entry = (depth, score, bound, None if move_from is None else (move_from, move_to))
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def store(self, key, depth, score, bound_type, best_move):
+        with self._lock:
+            old_entry = self.pending.get(key)
+            if old_entry is None or depth >= old_entry[0]:
+                self.pending[key] = (depth, score, bound_type, best_move)
+
+    def flush(self):
+        # Writes the buffered entries in one transaction, then trims the file to max_entries
+        with self._lock:
+            if not self.pending:
+                return
+            now = time.time()
+            rows = [(_signed(key), depth, score, bound, *(best_move or (None, None)), now)
+                    for key, (depth, score, bound, best_move) in self.pending.items()]
+            self.pending = {}
+            with self._db:
+                self._db.executemany('INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET '
+                                     'depth = excluded.depth, score = excluded.score, bound = excluded.bound, '
+                                     'move_from = excluded.move_from, move_to = excluded.move_to, stored = excluded.stored '
+                                     'WHERE excluded.depth >= positions.depth', rows)
+                overflow = self._db.execute('SELECT COUNT(*) FROM positions').fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    # Trim a little extra so the count is not checked against the cap on every flush
+                    self._db.execute('DELETE FROM positions WHERE key IN (SELECT key FROM positions ORDER BY stored LIMIT ?)',
+                                     (overflow + self.max_entries // 20,))
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def stats(self):
+        return {'path': self.path, 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,566 @@
+import os
+import sys
+import json
+import time
+import queue
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from tablebase import DEFAULT_TABLEBASE_PATH, load_tablebase
+from poscache import PositionCache
+from engine import (SEARCH_MODES, SEARCH_LOG, TranspositionTable, SearchResult, Ponderer, iterative_deepening, legal_moves,
+                    is_legal_move, parse_position_line, move_to_text, parse_move, position_to_fen, set_tablebase, configure_search_log)
+
+# Line-based engine protocol modelled on UCI, so the search can run in its own process (or on another
+# machine) behind any front end. The engine reads one command per line on stdin and answers on stdout:
+#
+#   python protocol.py
+#
+#   uci                                        -> id and option lines, then uciok
+#   setoption name <Name> value <value>        Hash, Mode, Tablebase, Cache, SearchLog, Stats
+#   isready                                    -> readyok once the tablebase and cache are open
+#   ucinewgame                                 forget the transposition table
+#   position fen <fen> [moves <m1> <m2> ...]
+#   position kpk <wk> <wp> <bk> [w|b] [moves ...]   the KPK material by square, White to move by default
+#   go [depth N] [movetime MS] [nodes N] [infinite] [ponder]
+#                                              -> one info line per completed depth, then bestmove <move>
+#   stop                                       ends the search, bestmove follows at once
+#   quit
+#
+# Moves are in long algebraic notation ('d2d4', 'd7d8q'); 'bestmove 0000' means there is no legal move
+# or the game is already over (pawn promoted or captured). 'go depth 0' answers without searching.
+# The moves after 'position' are the game so far and give the repetition counts the search uses.
+# Info lines carry depth, score (cp, from White's perspective), nodes, nps, time (ms), hashfull and pv;
+# with the Stats option the full engine.SearchStats follow as 'info string stats <json>'.
+# 'go ponder' searches every reply of the side to move in the background (engine.Ponderer) and prints
+# nothing: the next 'go' after one of those replies is answered at once when its search had finished.
+# Errors are reported as 'info string error <message>'. A 'go' is answered by exactly one bestmove or,
+# if it is rejected, one error line; clients send 'isready' after 'position' to learn whether it was accepted.
+#
+# EngineProcess and EnginePool below are the client side. They start engine processes (this file with
+# the current Python by default, or any command that runs it elsewhere, e.g. over ssh), keep them warm
+# between searches and restart an engine that stops answering.
+
+ENGINE_NAME = 'Chess-Minimax KPK'
+ENGINE_AUTHOR = 'Chess-Minimax'
+DEFAULT_OPTIONS = {
+    'Hash': 200000, # Transposition table entries
+    'Mode': 'alphabeta', # Search algorithm, one of engine.SEARCH_MODES
+    'Tablebase': DEFAULT_TABLEBASE_PATH, # KPK tablebase file (generated if missing), empty to search without it
+    'Cache': '', # Persistent position cache file (poscache.py), empty to disable
+    'SearchLog': '', # Per-move JSON statistics log, empty to disable
+    'Stats': False, # Send the full search statistics after each search
+}
+OPTION_TYPES = {
+    'Hash': 'type spin default 200000 min 1 max 100000000',
+    'Mode': 'type combo default alphabeta ' + ' '.join(f'var {mode}' for mode in SEARCH_MODES),
+    'Tablebase': f'type string default {DEFAULT_TABLEBASE_PATH}',
+    'Cache': 'type string default <empty>',
+    'SearchLog': 'type string default <empty>',
+    'Stats': 'type check default false',
+}
+GO_LIMITS = ('depth', 'movetime', 'nodes')
+
+class ProtocolEngine:
+    # Engine side: handle() runs one command line, replies are written to out.
+    # Searches run on a background thread so 'stop' and 'isready' are answered while searching.
+    def __init__(self, out):
+        self.out = out
+        self._out_lock = threading.Lock() # The search thread writes info and bestmove lines
+        self.options = dict(DEFAULT_OPTIONS)
+        self._ready = False # Tablebase, cache, log and table match the options
+        self.tt = None
+        self.cache = None
+        self.tablebase = None
+        self.position = None
+        self.history = {}
+        self._repeated = set() # Positions seen twice in the game the transposition table was filled for
+        self._search_thread = None
+        self._stop_event = threading.Event()
+        self.ponderer = Ponderer()
+        self._pondering = False
+        self._predicted = None # (hash after the last best move, expected reply) from the principal variation
+
+    def send(self, line):
+        with self._out_lock:
+            try:
+                self.out.write(line + '\n')
+                self.out.flush()
+            except OSError:
+                pass # The client went away, quit follows when stdin closes
+
+    def handle(self, line):
+        # Runs one command; returns False after 'quit'
+        fields = line.split()
+        if not fields:
+            return True
+        command, args = fields[0], fields[1:]
+        try:
+            if command == 'uci':
+                self.send(f'id name {ENGINE_NAME}')
+                self.send(f'id author {ENGINE_AUTHOR}')
+                for name, declaration in OPTION_TYPES.items():
+                    self.send(f'option name {name} {declaration}')
+                self.send('uciok')
+            elif command == 'isready':
+                self._prepare()
+                self.send('readyok')
+            elif command == 'setoption':
+                self._stop_search()
+                self._stop_pondering()
+                self._set_option(args)
+            elif command == 'ucinewgame':
+                self._stop_search()
+                self._stop_pondering()
+                if self.tt is not None: self.tt.clear()
+                self._repeated = set()
+                self.position, self.history = None, {}
+            elif command == 'position':
+                self._stop_search()
+                self._set_position(args)
+            elif command == 'go':
+                self._stop_search()
+                self._go(args)
+            elif command == 'stop':
+                self._stop_search()
+                self._stop_pondering()
+            elif command == 'quit':
+                self.close()
+                return False
+            else:
+                self.send(f"info string error Unknown command '{command}'")
+        except ValueError as e:
+            self.send(f'info string error {e}')
+        return True
+
+    def _set_option(self, args):
+        if 'name' not in args:
+            raise ValueError("Expected 'setoption name <name> value <value>'")
+        value_index = args.index('value') if 'value' in args else len(args)
+        name = ' '.join(args[args.index('name') + 1:value_index])
+        value = ' '.join(args[value_index + 1:])
+        value = '' if value == '<empty>' else value
+        if name not in DEFAULT_OPTIONS:
+            raise ValueError(f"Unknown option '{name}'")
+        if name == 'Hash':
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError("Hash must be a positive number of entries")
+            value = int(value)
+        elif name == 'Mode' and value not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{value}'")
+        elif name == 'Stats':
+            if value not in ('true', 'false'):
+                raise ValueError("Stats must be true or false")
+            value = value == 'true'
+        self.options[name] = value
+        if name in ('Hash', 'Tablebase', 'Cache', 'SearchLog'):
+            self._ready = False
+
+    def _prepare(self):
+        # Opens the tablebase, cache and log and creates the transposition table for the current options
+        if self._ready:
+            return
+        if self.tablebase is not None: self.tablebase.close()
+        self.tablebase = load_tablebase(self.options['Tablebase']) if self.options['Tablebase'] else None
+        set_tablebase(self.tablebase)
+        if self.cache is not None: self.cache.close()
+        self.cache = PositionCache(self.options['Cache']) if self.options['Cache'] else None
+        for handler in list(SEARCH_LOG.handlers):
+            SEARCH_LOG.removeHandler(handler)
+            handler.close()
+        if self.options['SearchLog']:
+            configure_search_log(self.options['SearchLog'])
+        self.tt = TranspositionTable(max_entries=self.options['Hash'])
+        self._repeated = set()
+        self._ready = True
+
+    def _set_position(self, args):
+        self.position, self.history = None, {} # Until the new one is valid, 'go' has nothing to search
+        split = args.index('moves') if 'moves' in args else len(args)
+        setup, moves = args[:split], args[split + 1:]
+        if len(setup) < 2 or setup[0] not in ('fen', 'kpk'):
+            raise ValueError("Expected 'position fen <fen>' or 'position kpk <wk> <wp> <bk> [w|b]'")
+        if setup[0] == 'fen' and '/' not in setup[1]:
+            raise ValueError(f"Invalid FEN '{' '.join(setup[1:])}'")
+        position = parse_position_line(' '.join(setup[1:]))
+        history = {position.hash: 1}
+        for text in moves:
+            move = parse_move(text)
+            if not is_legal_move(position, move):
+                raise ValueError(f"Illegal move '{text}'")
+            position.make_move(move)
+            history[position.hash] = history.get(position.hash, 0) + 1
+        self.position, self.history = position, history
+
+    def _sync_table(self):
+        # Cached scores assume the repetition counts they were searched with, so the table is cleared
+        # whenever the set of repeated positions changes (a repetition in this game, or another game)
+        repeated = {key for key, count in self.history.items() if count >= 2}
+        if repeated != self._repeated:
+            self.ponderer.stop() # Finished ponder results stay available to take()
+            self.tt.clear()
+            self._repeated = repeated
+
+    def _go(self, args):
+        limits = dict.fromkeys(GO_LIMITS)
+        infinite = ponder = False
+        i = 0
+        while i < len(args):
+            if args[i] in GO_LIMITS and i + 1 < len(args) and args[i + 1].isdigit():
+                limits[args[i]] = int(args[i + 1])
+                i += 2
+            elif args[i] in ('infinite', 'ponder'):
+                infinite = infinite or args[i] == 'infinite'
+                ponder = ponder or args[i] == 'ponder'
+                i += 1
+            else:
+                raise ValueError(f"Invalid go parameter '{args[i]}'")
+        if self.position is None:
+            raise ValueError("No position set")
+        self._prepare()
+        self._sync_table()
+        if infinite: # Until 'stop' (or a forced result)
+            limits = dict.fromkeys(GO_LIMITS)
+        options = {
+            'max_depth': limits['depth'] if limits['depth'] is not None else 64,
+            'time_limit': None if limits['movetime'] is None else limits['movetime'] / 1000,
+            'node_limit': limits['nodes'],
+            'mode': self.options['Mode'],
+            'tt': self.tt,
+            'cache': self.cache,
+        }
+        if ponder:
+            predicted = self._predicted[1] if self._predicted and self._predicted[0] == self.position.hash else None
+            self.ponderer.start(self.position, self.history, predicted, **options)
+            self._pondering = True
+            return
+        if self._pondering:
+            self._pondering = False
+            result = self.ponderer.take(self.position)
+            if result is not None:
+                self.send('info string ponderhit')
+                self._info(self.position, result)
+                self._finish(self.position, result)
+                return
+        self._stop_event.clear()
+        self._search_thread = threading.Thread(target=self._search, args=(self.position.copy(), dict(self.history), options), daemon=True)
+        self._search_thread.start()
+
+    def _search(self, position, history, options):
+        result = iterative_deepening(position, history, stop_event=self._stop_event, collect_stats=self.options['Stats'],
+                                     on_iteration=lambda iteration: self._info(position, iteration), **options)
+        self._finish(position, result)
+
+    def _info(self, position, result):
+        summary = result.to_dict(position)
+        fields = ['info', 'depth', result.depth, 'score', 'cp', result.score, 'nodes', result.nodes]
+        if summary['nps'] is not None:
+            fields += ['nps', summary['nps']]
+        fields += ['time', round(result.elapsed * 1000)]
+        if self.tt is not None:
+            fields += ['hashfull', len(self.tt.entries) * 1000 // self.tt.max_entries]
+        if summary['pv']:
+            fields += ['pv'] + summary['pv']
+        self.send(' '.join(str(field) for field in fields))
+
+    def _finish(self, position, result):
+        # Sends the statistics and the best move of a finished search
+        if result is None:
+            # Stopped before depth 1 finished (or depth 0 asked for): any legal move
+            moves = legal_moves(position)
+            move = moves[0] if moves else None
+        else:
+            move = result.move # None when the game is over or there is no legal move
+        if result is not None and result.stats is not None and self.options['Stats']:
+            self.send(f'info string stats {json.dumps(result.stats.to_dict())}')
+        self._predicted = None
+        if result is not None and len(result.pv) > 1 and result.pv[0] == move:
+            after = position.copy()
+            after.make_move(move)
+            self._predicted = (after.hash, result.pv[1])
+        self.send(f'bestmove {move_to_text(position, move) if move else "0000"}')
+
+    def _stop_search(self):
+        # Stops the running search and waits for its bestmove
+        if self._search_thread is not None:
+            self._stop_event.set()
+            self._search_thread.join()
+            self._search_thread = None
+
+    def _stop_pondering(self):
+        self.ponderer.stop()
+        self._pondering = False
+
+    def close(self):
+        self._stop_search()
+        self._stop_pondering()
+        if self.cache is not None: self.cache.close()
+        if self.tablebase is not None: self.tablebase.close()
+        self.cache = self.tablebase = None
+
+def main():
+    out = sys.stdout
+    sys.stdout = sys.stderr # Progress messages (e.g. tablebase generation) must not mix with the replies
+    engine = ProtocolEngine(out)
+    for line in sys.stdin:
+        if not engine.handle(line):
+            return
+    engine.close() # stdin closed without 'quit'
+
+# Client side
+
+ENGINE_COMMAND = [sys.executable, os.path.abspath(__file__)]
+STOP_GRACE = 5.0 # Seconds an engine gets to answer 'stop' before it is restarted
+
+class EngineError(Exception):
+    # The engine process exited, reported an error or did not answer in time
+    pass
+
+def format_option(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '<empty>' if value is None or value == '' else str(value)
+
+def parse_info(fields):
+    # Values of an 'info' line as a dict: numbers by name, 'score' in cp, 'pv' as move texts
+    info = {}
+    i = 1
+    while i < len(fields):
+        name = fields[i]
+        if name in ('pv', 'string'):
+            info[name] = fields[i + 1:]
+            break
+        if name == 'score' and i + 2 < len(fields):
+            info['score'] = int(fields[i + 2])
+            i += 3
+            continue
+        if i + 1 < len(fields):
+            info[name] = int(fields[i + 1])
+        i += 2
+    return info
+
+class EngineProcess:
+    # One engine process. go() and poll() never block, for the pygame loop; search() waits for the
+    # answer and restarts the process if it stops answering. Results are engine.SearchResult objects.
+    def __init__(self, command=None, options=None, ready_timeout=None):
+        self.command = list(command) if command else ENGINE_COMMAND
+        self.options = dict(options or {}) # setoption values sent after every (re)start
+        self.ready_timeout = ready_timeout # Seconds to wait for uciok/readyok (the tablebase may be generated first)
+        self.name = None
+        self.pondered = False # The last result came from pondering
+        self.last_stats = None # Statistics sent with the last result (Stats option)
+        self._process = None
+        self._lines = None
+        self._search = None # Start time and latest info of the running search
+        self.start()
+
+    def start(self):
+        # Starts the process and waits until it has applied the options and is ready
+        self._lines = queue.Queue()
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        threading.Thread(target=self._read, args=(self._process.stdout, self._lines), daemon=True).start()
+        self._search = None
+        self.send('uci')
+        for line in self._wait_for('uciok'):
+            if line.startswith('id name '):
+                self.name = line[len('id name '):]
+        for name, value in self.options.items():
+            self.send(f'setoption name {name} value {format_option(value)}')
+        self.send('isready')
+        self._wait_for('readyok')
+
+    @staticmethod
+    def _read(stream, lines):
+        for line in stream:
+            lines.put(line.rstrip('\n'))
+        lines.put(None) # End of output: the process exited
+
+    def _next_line(self, timeout=None):
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if line is None:
+            self._lines.put(None)
+            self._search = None
+            raise EngineError(f"Engine process exited with code {self._process.wait()}")
+        return line
+
+    def _wait_for(self, token):
+        # Lines up to and including the one starting with token. An error reported on the way is
+        # raised once token has arrived, so no reply to the failed command is left unread.
+        lines = []
+        error = None
+        deadline = None if self.ready_timeout is None else time.perf_counter() + self.ready_timeout
+        while True:
+            line = self._next_line(None if deadline is None else max(0.0, deadline - time.perf_counter()))
+            if line is None:
+                raise EngineError(f"Engine did not answer '{token}' within {self.ready_timeout}s")
+            if line.startswith('info string error '):
+                error = error or line[len('info string error '):]
+                continue
+            lines.append(line)
+            if line.split()[:1] == [token]:
+                if error is not None:
+                    raise EngineError(error)
+                return lines
+
+    def send(self, line):
+        try:
+            self._process.stdin.write(line + '\n')
+            self._process.stdin.flush()
+        except OSError as e:
+            raise EngineError(f"Engine process is not running ({e})")
+
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    def go(self, position, moves=(), depth=None, movetime=None, nodes=None, ponder=False):
+        # Sends the game (start position and the moves played since, as (from_sq, to_sq) tuples) and
+        # starts searching its last position. movetime is in seconds. With ponder=True the engine
+        # ponders the replies instead and nothing is returned by poll().
+        if self._search is not None:
+            raise EngineError("A search is already running")
+        board = position.copy()
+        texts = []
+        for move in moves:
+            texts.append(move_to_text(board, move))
+            board.make_move(move)
+        self.send(f"position fen {position_to_fen(position)}" + (f" moves {' '.join(texts)}" if texts else ''))
+        # A rejected position is reported before readyok; 'go' is then not sent at all
+        self.send('isready')
+        self._wait_for('readyok')
+        command = ['go']
+        if ponder: command.append('ponder')
+        if depth is not None: command += ['depth', depth]
+        if movetime is not None: command += ['movetime', max(1, round(movetime * 1000))]
+        if nodes is not None: command += ['nodes', nodes]
+        self.send(' '.join(str(field) for field in command))
+        if not ponder:
+            self._search = {'start': time.perf_counter(), 'info': {}, 'pondered': False, 'stats': None}
+
+    def busy(self):
+        # True from go() until poll() or search() has returned the result
+        return self._search is not None
+
+    def poll(self):
+        # Returns the SearchResult once 'bestmove' has arrived, None while the search is still running
+        while self._search is not None:
+            line = self._next_line(0)
+            if line is None:
+                return None
+            result = self._handle_line(line)
+            if result is not None:
+                return result
+        return None
+
+    def _handle_line(self, line):
+        fields = line.split()
+        if fields[:2] == ['info', 'string']:
+            text = line[len('info string '):]
+            if text.startswith('error '):
+                self._search = None
+                raise EngineError(text[len('error '):])
+            if text == 'ponderhit':
+                self._search['pondered'] = True
+            elif text.startswith('stats '):
+                self._search['stats'] = json.loads(text[len('stats '):])
+        elif fields[:1] == ['info']:
+            info = parse_info(fields)
+            if 'depth' in info:
+                self._search['info'] = info
+        elif fields[:1] == ['bestmove']:
+            search, self._search = self._search, None
+            info = search['info']
+            move = None if fields[1] == '0000' else parse_move(fields[1])
+            pv = [parse_move(text) for text in info.get('pv', [])]
+            if pv[:1] != [move]: # Stopped before the first depth finished
+                pv = [move] if move else []
+            self.pondered = search['pondered']
+            self.last_stats = search['stats']
+            return SearchResult(info.get('score', 0), move, info.get('depth', 0), info.get('nodes', 0), pv,
+                                time.perf_counter() - search['start'])
+        return None
+
+    def stop(self):
+        # Ends the running search (poll() then returns its result) or pondering
+        self.send('stop')
+
+    def search(self, position, moves=(), timeout=None, **limits):
+        # Blocking search. After timeout seconds the engine is told to stop; if it still has not
+        # answered STOP_GRACE seconds later it is restarted and EngineError is raised.
+        self.go(position, moves, **limits)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        stopped = False
+        while True:
+            line = self._next_line(None if deadline is None else max(0.0, deadline - time.perf_counter()))
+            if line is None:
+                if stopped:
+                    self.restart()
+                    raise EngineError(f"Engine did not answer within {timeout + STOP_GRACE:.1f}s and was restarted")
+                self.stop()
+                stopped = True
+                deadline = time.perf_counter() + STOP_GRACE
+                continue
+            result = self._handle_line(line)
+            if result is not None:
+                return result
+
+    def restart(self):
+        self._process.kill()
+        self._process.wait()
+        self.start()
+
+    def close(self):
+        if self.alive():
+            try:
+                self.send('quit')
+                self._process.stdin.close()
+                self._process.wait(timeout=STOP_GRACE)
+            except (EngineError, OSError, subprocess.TimeoutExpired):
+                self._process.kill()
+                self._process.wait()
+        self._search = None
+
+class EnginePool:
+    # Keeps size warm engine processes and hands each search to an idle one. search() may be called
+    # from several threads at once and blocks until an engine is free; map() keeps all of them busy.
+    def __init__(self, size=None, command=None, options=None, timeout=None):
+        size = size or os.cpu_count() or 1
+        self.timeout = timeout # Wall-clock limit per search, see EngineProcess.search
+        # The first engine generates the tablebase file if it is missing, the others then only open it
+        self.engines = [EngineProcess(command, options)]
+        with ThreadPoolExecutor(max_workers=size) as starter:
+            self.engines += list(starter.map(lambda _: EngineProcess(command, options), range(size - 1)))
+        self._idle = queue.Queue()
+        for engine in self.engines:
+            self._idle.put(engine)
+
+    def search(self, position, moves=(), **limits):
+        engine = self._idle.get()
+        try:
+            return engine.search(position, moves, timeout=self.timeout, **limits)
+        except EngineError:
+            if not engine.alive():
+                engine.restart()
+            raise
+        finally:
+            self._idle.put(engine)
+
+    def map(self, positions, **limits):
+        # Searches every position (with no moves played before it) and returns the results in order
+        with ThreadPoolExecutor(max_workers=len(self.engines)) as executor:
+            return list(executor.map(lambda position: self.search(position, **limits), positions))
+
+    def close(self):
+        for engine in self.engines:
+            engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+if __name__ == '__main__':
+    main()
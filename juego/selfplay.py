@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tablebase import DEFAULT_TABLEBASE_PATH, KPKTablebase, load_tablebase
+from engine import (SEARCH_MODES, Position, TranspositionTable, iterative_deepening, legal_moves, game_result,
+                    move_to_text, position_to_fen, validate_position, set_tablebase)
+
+# Headless self-play: the AI plays White against a scripted or engine-driven Black, many games
+# in parallel worker processes, under the same end-of-game rules as the GUI (engine.game_result).
+#
+#   python selfplay.py --games 200 --depth 6 --black random
+#   python selfplay.py --enumerate --games 1000 --movetime 0.05 --black engine --no-tablebase
+#
+# Start positions are random legal (WK, WP, BK) placements with White to move, or with --enumerate
+# every legal placement in square order. A summary (games/sec, result rates, move latency and
+# nodes per move) is printed as JSON; --output also writes one JSON line per game.
+
+MAX_PLIES = 300 # Games still running after this many moves are counted as unfinished
+
+def random_start_positions(count, seed):
+    # Random legal start positions with White to move
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        wk, wp, bk = rng.randrange(64), rng.randrange(8, 56), rng.randrange(64)
+        position = _start_position(wk, wp, bk)
+        if position is not None:
+            positions.append(position)
+    return positions
+
+def enumerated_start_positions():
+    # Every legal start position with White to move, in (WK, WP, BK) square order
+    for wk in range(64):
+        for wp in range(8, 56):
+            for bk in range(64):
+                position = _start_position(wk, wp, bk)
+                if position is not None:
+                    yield position
+
+def _start_position(wk, wp, bk):
+    if len({wk, wp, bk}) != 3:
+        return None
+    position = Position(wk, wp, bk, True)
+    try:
+        validate_position(position)
+    except ValueError:
+        return None
+    return position if game_result(position, {}) is None else None
+
+def choose_black_move(position, history, black, settings, rng, tt):
+    # Returns (move, search result or None) for the Black side
+    if black == 'random':
+        return rng.choice(legal_moves(position)), None
+    result = iterative_deepening(position, history, max_depth=settings['black_depth'], time_limit=settings['black_movetime'],
+                                 tt=tt, mode=settings['mode'], log=False)
+    return result.move, result
+
+def play_game(game_index, start_position, settings):
+    # Plays one game from the position and returns its JSON-ready record
+    position = start_position.copy()
+    start_fen = position_to_fen(position)
+    rng = random.Random(settings['seed'] * 1000003 + game_index)
+    history = {position.hash: 1}
+    # One table per side and game, cleared like the GUI's whenever a position occurs a second time
+    white_tt = TranspositionTable(max_entries=settings['tt_entries'])
+    black_tt = TranspositionTable(max_entries=settings['tt_entries'])
+    white_moves = white_nodes = 0
+    white_time = 0.0
+    moves = []
+    outcome = game_result(position, history)
+    while outcome is None and len(moves) < MAX_PLIES:
+        if position.white_to_move:
+            start_time = time.perf_counter()
+            result = iterative_deepening(position, history, max_depth=settings['depth'], time_limit=settings['movetime'],
+                                         tt=white_tt, mode=settings['mode'], log=False)
+            white_time += time.perf_counter() - start_time
+            white_moves += 1
+            white_nodes += result.nodes
+            move = result.move
+        else:
+            move, _ = choose_black_move(position, history, settings['black'], settings, rng, black_tt)
+        moves.append(move_to_text(position, move))
+        position.make_move(move) # Promotes the pawn to a queen on the last row, as in the GUI
+        history[position.hash] = history.get(position.hash, 0) + 1
+        if history[position.hash] == 2:
+            white_tt.clear()
+            black_tt.clear()
+        outcome = game_result(position, history)
+    winner, reason = outcome if outcome is not None else (None, 'unfinished')
+    return {
+        'game': game_index,
+        'start': start_fen,
+        'winner': winner,
+        'reason': reason,
+        'plies': len(moves),
+        'white_moves': white_moves,
+        'white_time': round(white_time, 6),
+        'white_nodes': white_nodes,
+        'moves': moves,
+    }
+
+def _init_worker(tablebase_path):
+    set_tablebase(KPKTablebase(tablebase_path) if tablebase_path is not None else None)
+
+def run_games(positions, settings, workers, tablebase_path, output=None):
+    # Plays every start position and returns the list of game records (in completion order)
+    records = []
+    def collect(record):
+        records.append(record)
+        if output is not None:
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+    if workers <= 1:
+        _init_worker(tablebase_path)
+        for game_index, position in enumerate(positions):
+            collect(play_game(game_index, position, settings))
+        return records
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tablebase_path,)) as pool:
+        futures = [pool.submit(play_game, game_index, position, settings) for game_index, position in enumerate(positions)]
+        for future in as_completed(futures):
+            collect(future.result())
+    return records
+
+def summarize(records, elapsed):
+    games = len(records)
+    white_moves = sum(r['white_moves'] for r in records)
+    reasons = {}
+    for r in records:
+        reasons[r['reason']] = reasons.get(r['reason'], 0) + 1
+    def rate(count):
+        return count / games if games else None
+    return {
+        'games': games,
+        'time': round(elapsed, 3),
+        'games_per_sec': games / elapsed if elapsed else None,
+        'white_win_rate': rate(sum(r['winner'] == 'W' for r in records)),
+        'draw_rate': rate(sum(r['winner'] is None and r['reason'] != 'unfinished' for r in records)),
+        'white_loss_rate': rate(sum(r['winner'] == 'B' for r in records)),
+        'unfinished': reasons.get('unfinished', 0),
+        'reasons': reasons,
+        'average_plies': rate(sum(r['plies'] for r in records)),
+        'average_move_latency': sum(r['white_time'] for r in records) / white_moves if white_moves else None,
+        'average_nodes_per_move': sum(r['white_nodes'] for r in records) / white_moves if white_moves else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play AI self-play games in parallel and report results and speed.")
+    parser.add_argument('--games', type=int, default=100, help="Number of games (default 100)")
+    parser.add_argument('--enumerate', action='store_true', help="Use every legal start position in order instead of random ones")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for random start positions and the random Black side")
+    parser.add_argument('--depth', type=int, default=None, help="White search depth (default 6 without --movetime)")
+    parser.add_argument('--movetime', type=float, default=None, help="White search time per move in seconds")
+    parser.add_argument('--mode', choices=SEARCH_MODES, default='alphabeta', help="Search algorithm (default alphabeta)")
+    parser.add_argument('--black', choices=('random', 'engine'), default='random', help="Black side: random legal moves or the engine")
+    parser.add_argument('--black-depth', type=int, default=4, help="Search depth of the engine-driven Black side (default 4)")
+    parser.add_argument('--black-movetime', type=float, default=None, help="Search time per move of the engine-driven Black side")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes (default: all cores)")
+    parser.add_argument('--tablebase', default=DEFAULT_TABLEBASE_PATH, help="KPK tablebase file (generated if missing)")
+    parser.add_argument('--no-tablebase', action='store_true', help="Play from search only")
+    parser.add_argument('--output', '-o', help="Write one JSON line per game to this file")
+    args = parser.parse_args(argv)
+
+    settings = {
+        'depth': args.depth if args.depth is not None else (64 if args.movetime is not None else 6),
+        'movetime': args.movetime,
+        'mode': args.mode,
+        'black': args.black,
+        'black_depth': args.black_depth,
+        'black_movetime': args.black_movetime,
+        'seed': args.seed,
+        'tt_entries': 100000,
+    }
+    tablebase_path = None
+    if not args.no_tablebase:
+        load_tablebase(args.tablebase).close() # Generates the file once, before the workers start
+        tablebase_path = args.tablebase
+    if args.enumerate:
+        positions = []
+        for position in enumerated_start_positions():
+            if len(positions) == args.games:
+                break
+            positions.append(position)
+    else:
+        positions = random_start_positions(args.games, args.seed)
+
+    output = open(args.output, 'w') if args.output else None
+    start_time = time.perf_counter()
+    try:
+        records = run_games(positions, settings, args.workers, tablebase_path, output)
+    finally:
+        if output is not None:
+            output.close()
+    summary = summarize(records, time.perf_counter() - start_time)
+    summary['settings'] = settings
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    main()
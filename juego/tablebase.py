@@ -0,0 +1,239 @@
+import os
+import sys
+import mmap
+from array import array
+from tables import KING_MOVES, KING_ADJACENT, PAWN_CAPTURES
+
+# King + Pawn vs King tablebase built by retrograde analysis.
+# Squares are indexed 0..63 as row * 8 + col, with row 0 at the top of the board
+# (the white pawn promotes on row 0), matching the (row, col) layout in chess.py.
+#
+# Every position (side to move, WK, WP, BK) with the pawn on rows 1..6 gets one byte:
+#   DRAW (0)             draw with best play (stalemate or no forced result)
+#   WIN_BASE + n (1..127)   White wins: promotion (or mate) in n plies
+#   LOSS_BASE + n (128..254) Black captures the pawn in n plies
+#   ILLEGAL (255)        position cannot occur
+# The file is a flat 2*64*48*64 byte array (384 KB) and is memory-mapped when loaded.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TABLEBASE_PATH = os.path.join(BASE_DIR, 'kpk.bin')
+
+DRAW = 0
+WIN_BASE = 1
+LOSS_BASE = 128
+ILLEGAL = 255
+
+WHITE_TO_MOVE, BLACK_TO_MOVE = 0, 1
+PAWN_SQUARES = 48 # Pawn can stand on rows 1..6
+TABLE_SIZE = 2 * 64 * PAWN_SQUARES * 64
+WHITE_PAWN_CAPTURES = PAWN_CAPTURES['W']
+
+def kings_adjacent(a, b):
+    return b in KING_ADJACENT[a]
+
+def pawn_attacks(wp, sq):
+    # True if the white pawn on wp attacks sq (pawn moves towards row 0)
+    return sq in WHITE_PAWN_CAPTURES[wp]
+
+def position_index(side, wk, wp, bk):
+    return ((side * 64 + wk) * PAWN_SQUARES + (wp - 8)) * 64 + bk
+
+def is_legal_position(side, wk, wp, bk):
+    if wk == wp or wk == bk or wp == bk:
+        return False
+    if not 8 <= wp < 56 or kings_adjacent(wk, bk):
+        return False
+    if side == WHITE_TO_MOVE and pawn_attacks(wp, bk): # Black cannot have left its king in check
+        return False
+    return True
+
+def white_moves(wk, wp, bk):
+    # Yields (from_sq, to_sq, successor) for every legal White move.
+    # successor is None when the move promotes the pawn (an immediate win).
+    for to_sq in KING_MOVES[wk]:
+        if to_sq != wp and not kings_adjacent(to_sq, bk):
+            yield wk, to_sq, (to_sq, wp, bk)
+    push = wp - 8
+    if push != wk and push != bk:
+        if push < 8:
+            yield wp, push, None
+        else:
+            yield wp, push, (wk, push, bk)
+            double_push = wp - 16
+            if wp >= 48 and double_push != wk and double_push != bk:
+                yield wp, double_push, (wk, double_push, bk)
+
+def black_moves(wk, wp, bk):
+    # Yields (from_sq, to_sq, successor) for every legal Black move.
+    # successor is None when the king captures the pawn.
+    for to_sq in KING_MOVES[bk]:
+        if kings_adjacent(to_sq, wk) or pawn_attacks(wp, to_sq):
+            continue
+        if to_sq == wp:
+            if not kings_adjacent(wp, wk): # Pawn is only capturable when undefended
+                yield bk, to_sq, None
+        else:
+            yield bk, to_sq, (wk, wp, to_sq)
+
+def generate_tablebase():
+    # Retrograde analysis over every KPK position. Returns a bytearray of TABLE_SIZE values.
+    values = bytearray([ILLEGAL]) * TABLE_SIZE
+
+    # Forward pass: successors of every legal position, stored as a flat edge list
+    succ_start = array('i', [0]) * (TABLE_SIZE + 1)
+    succ = array('i')
+    win_now = [] # White to move with a promotion available, or Black checkmated
+    loss_now = [] # Black to move with an undefended pawn to capture
+    for side in (WHITE_TO_MOVE, BLACK_TO_MOVE):
+        for wk in range(64):
+            for wp in range(8, 56):
+                for bk in range(64):
+                    idx = position_index(side, wk, wp, bk)
+                    succ_start[idx] = len(succ)
+                    if not is_legal_position(side, wk, wp, bk):
+                        continue
+                    values[idx] = DRAW
+                    if side == WHITE_TO_MOVE:
+                        for _, _, nxt in white_moves(wk, wp, bk):
+                            if nxt is None:
+                                win_now.append(idx)
+                            else:
+                                succ.append(position_index(BLACK_TO_MOVE, nxt[0], nxt[1], nxt[2]))
+                    else:
+                        has_move = False
+                        for _, _, nxt in black_moves(wk, wp, bk):
+                            has_move = True
+                            if nxt is None:
+                                loss_now.append(idx)
+                            else:
+                                succ.append(position_index(WHITE_TO_MOVE, nxt[0], nxt[1], nxt[2]))
+                        if not has_move and pawn_attacks(wp, bk):
+                            win_now.append(idx) # Checkmate
+    succ_start[TABLE_SIZE] = len(succ)
+
+    # Reverse the edge list into predecessor lists (CSR layout)
+    pred_start = array('i', [0]) * (TABLE_SIZE + 1)
+    for child in succ:
+        pred_start[child + 1] += 1
+    for idx in range(TABLE_SIZE):
+        pred_start[idx + 1] += pred_start[idx]
+    pred = array('i', [0]) * len(succ)
+    fill = array('i', pred_start)
+    for parent in range(TABLE_SIZE):
+        for e in range(succ_start[parent], succ_start[parent + 1]):
+            child = succ[e]
+            pred[fill[child]] = parent
+            fill[child] += 1
+
+    half = TABLE_SIZE // 2 # Indices below this are White to move
+    _propagate(values, win_now, set(loss_now), WIN_BASE, half, succ_start, pred_start, pred, attacker_is_white=True)
+    _propagate(values, loss_now, set(), LOSS_BASE, half, succ_start, pred_start, pred, attacker_is_white=False)
+    return values
+
+def _propagate(values, seeds, escapes, base, half, succ_start, pred_start, pred, attacker_is_white):
+    # Breadth-first retrograde propagation of a forced result, one ply distance at a time.
+    # The attacker needs one move into the result set; the defender must have every move lead into it.
+    # escapes: defender positions with an immediate way out (capture / promotion), never forced.
+    layers = {}
+    for idx in seeds:
+        if values[idx] != DRAW:
+            continue
+        if (idx < half) == attacker_is_white:
+            distance = 1 # Promotes / captures right now
+        else:
+            distance = 0 # Checkmated, no moves left
+        values[idx] = base + distance
+        layers.setdefault(distance, []).append(idx)
+
+    remaining = {}
+    distance = 0
+    while layers:
+        layer = layers.pop(distance, [])
+        for idx in layer:
+            for e in range(pred_start[idx], pred_start[idx + 1]):
+                parent = pred[e]
+                if values[parent] != DRAW or parent in escapes:
+                    continue
+                if (parent < half) != attacker_is_white: # Defender to move
+                    left = remaining.get(parent, succ_start[parent + 1] - succ_start[parent]) - 1
+                    remaining[parent] = left
+                    if left:
+                        continue
+                values[parent] = base + distance + 1
+                layers.setdefault(distance + 1, []).append(parent)
+        distance += 1
+
+class KPKTablebase:
+    # Read-only view over a generated tablebase file (memory-mapped)
+    def __init__(self, path=DEFAULT_TABLEBASE_PATH):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) != TABLE_SIZE:
+            raise ValueError(f"Tablebase file '{path}' has the wrong size.")
+
+    def probe(self, wk, wp, bk, white_to_move):
+        # Raw byte for the position, or ILLEGAL if it is not covered by the table
+        if not 8 <= wp < 56:
+            return ILLEGAL
+        side = WHITE_TO_MOVE if white_to_move else BLACK_TO_MOVE
+        return self.data[position_index(side, wk, wp, bk)]
+
+    def best_move(self, wk, wp, bk, white_to_move):
+        # Returns (from_sq, to_sq, value) with the best result for the side to move,
+        # or None if the position is not in the table or has no legal moves.
+        # Value is the tablebase byte of the position after the move (None for promotion/capture).
+        if self.probe(wk, wp, bk, white_to_move) == ILLEGAL:
+            return None
+        best = None
+        best_rank = None
+        if white_to_move:
+            for from_sq, to_sq, nxt in white_moves(wk, wp, bk):
+                if nxt is None:
+                    return from_sq, to_sq, None # Promotion wins on the spot
+                value = self.probe(nxt[0], nxt[1], nxt[2], False)
+                rank = _rank_for_white(value)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = (from_sq, to_sq, value), rank
+        else:
+            for from_sq, to_sq, nxt in black_moves(wk, wp, bk):
+                if nxt is None:
+                    return from_sq, to_sq, None # Capturing the pawn wins on the spot
+                value = self.probe(nxt[0], nxt[1], nxt[2], True)
+                rank = -_rank_for_white(value)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = (from_sq, to_sq, value), rank
+        return best
+
+    def close(self):
+        self.data.close()
+        self._file.close()
+
+def _rank_for_white(value):
+    # Orders tablebase values from White's point of view: fast wins > slow wins > draws > slow losses > fast losses
+    if WIN_BASE <= value < LOSS_BASE:
+        return 1000 - value
+    if LOSS_BASE <= value < ILLEGAL:
+        return -1000 + (value - LOSS_BASE)
+    return 0
+
+def write_tablebase(path=DEFAULT_TABLEBASE_PATH):
+    values = generate_tablebase()
+    tmp_path = f'{path}.{os.getpid()}.tmp' # Another process may be generating the same file
+    with open(tmp_path, 'wb') as f:
+        f.write(values)
+    os.replace(tmp_path, path) # Readers never see a half-written file
+    return path
+
+def load_tablebase(path=DEFAULT_TABLEBASE_PATH, generate=True):
+    # Opens the tablebase, generating it first if the file does not exist yet
+    if not os.path.exists(path):
+        if not generate:
+            return None
+        print("Generating KPK tablebase (one-time, this can take a minute)...")
+        write_tablebase(path)
+    return KPKTablebase(path)
+
+if __name__ == '__main__':
+    output_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_TABLEBASE_PATH
+    print(f"Writing KPK tablebase to {write_tablebase(output_path)}")
@@ -0,0 +1,72 @@
+# Move and attack tables for every square, built once at import.
+# Squares are indexed 0..63 as row * 8 + col with row 0 at the top (White pawns move towards row 0).
+
+ROWS, COLS = 8, 8 # Board Rows and Columns
+
+KING_DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+
+def _on_board(r, c):
+    return 0 <= r < ROWS and 0 <= c < COLS
+
+def _build_king_moves():
+    moves = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        moves.append(tuple((r + dr) * 8 + c + dc for dr, dc in KING_DIRECTIONS if _on_board(r + dr, c + dc)))
+    return moves
+
+def _build_pawn_tables(color_char):
+    # Push targets (single step first, then the double step from the starting row) and capture targets
+    step, start_row = (-1, 6) if color_char == 'W' else (1, 1)
+    pushes, captures = [], []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        push = []
+        if _on_board(r + step, c):
+            push.append((r + step) * 8 + c)
+            if r == start_row:
+                push.append((r + 2 * step) * 8 + c)
+        pushes.append(tuple(push))
+        captures.append(frozenset((r + step) * 8 + c + dc for dc in (-1, 1) if _on_board(r + step, c + dc)))
+    return pushes, captures
+
+def _build_queen_rays():
+    # For every square, the 8 rays a queen slides along, each ordered from nearest to farthest
+    rays = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        square_rays = []
+        for dr, dc in KING_DIRECTIONS:
+            ray = []
+            nr, nc = r + dr, c + dc
+            while _on_board(nr, nc):
+                ray.append(nr * 8 + nc)
+                nr += dr; nc += dc
+            if ray:
+                square_rays.append(tuple(ray))
+        rays.append(tuple(square_rays))
+    return rays
+
+def _build_squares_between(queen_rays):
+    # between[a][b]: squares strictly between a and b when they share a line, None otherwise
+    between = [[None] * 64 for _ in range(64)]
+    for sq in range(64):
+        for ray in queen_rays[sq]:
+            for distance, target in enumerate(ray):
+                between[sq][target] = ray[:distance]
+    return between
+
+KING_MOVES = _build_king_moves()
+KING_ADJACENT = [frozenset(moves) for moves in KING_MOVES]
+KING_DISTANCE = [[max(abs(a // 8 - b // 8), abs(a % 8 - b % 8)) for b in range(64)] for a in range(64)]
+# KING_MOVES_TOWARD[sq][target]: the king moves from sq, closest to target first (ties in square order)
+KING_MOVES_TOWARD = [[tuple(sorted(KING_MOVES[sq], key=lambda to_sq: KING_DISTANCE[to_sq][target])) for target in range(64)]
+                     for sq in range(64)]
+
+_white_pushes, _white_captures = _build_pawn_tables('W')
+_black_pushes, _black_captures = _build_pawn_tables('B')
+PAWN_PUSHES = {'W': _white_pushes, 'B': _black_pushes}
+PAWN_CAPTURES = {'W': _white_captures, 'B': _black_captures} # Also the squares the pawn attacks
+
+QUEEN_RAYS = _build_queen_rays()
+SQUARES_BETWEEN = _build_squares_between(QUEEN_RAYS)
@@ -0,0 +1,117 @@
+import sys
+import argparse
+import numpy as np
+from engine import Position, legal_moves, in_check, evaluate_board
+from evaluation import EVAL_TABLE
+from tables import KING_ADJACENT, PAWN_CAPTURES
+
+# NumPy batch versions of the rules and evaluation in engine.py, for analysis jobs and table building.
+# Every function takes equal-length arrays of squares (0..63, row * 8 + col) for WK, WP and BK
+# and, where needed, a boolean array that is True when White is to move. Positions in a batch
+# have all three pieces on the board and no queen. Results match engine.legal_moves, engine.in_check
+# and engine.evaluate_board (with an empty history) position by position; check that with
+#
+#   python vectorized.py --verify 100000 --seed 1
+
+SQUARES = np.arange(64)
+KING_ADJACENT_MASK = np.array([[b in KING_ADJACENT[a] for b in range(64)] for a in range(64)])
+PAWN_ATTACK_MASK = np.array([[b in PAWN_CAPTURES['W'][a] for b in range(64)] for a in range(64)]) # [wp, sq]
+EVAL_SCORES = np.asarray(EVAL_TABLE, dtype=np.int32)
+
+def _squares(*arrays):
+    result = []
+    for values in arrays:
+        values = np.asarray(values, dtype=np.int64)
+        if values.size and (values.min() < 0 or values.max() > 63):
+            raise ValueError("Squares must be in 0..63")
+        result.append(values)
+    if len({values.shape for values in result}) != 1:
+        raise ValueError("All arrays must have the same length")
+    return result
+
+def batch_in_check(wk, wp, bk, white_to_move):
+    # Boolean array: is the king of the side to move in check
+    wk, wp, bk = _squares(wk, wp, bk)
+    white_to_move = np.asarray(white_to_move, dtype=bool)
+    kings_adjacent = KING_ADJACENT_MASK[wk, bk]
+    return kings_adjacent | (~white_to_move & PAWN_ATTACK_MASK[wp, bk])
+
+def batch_evaluate(wk, wp, bk):
+    # int32 array of static scores from White's perspective
+    wk, wp, bk = _squares(wk, wp, bk)
+    return EVAL_SCORES[(wk * 64 + wp) * 64 + bk]
+
+def batch_legal_move_masks(wk, wp, bk, white_to_move):
+    # Returns (king_mask, pawn_mask), boolean arrays of shape (n, 64) marking the destination squares
+    # of the legal moves of the side to move's king and of the white pawn (always empty for Black).
+    wk, wp, bk = _squares(wk, wp, bk)
+    white = np.asarray(white_to_move, dtype=bool)[:, None]
+    on_wp = SQUARES == wp[:, None]
+    on_wk = SQUARES == wk[:, None]
+    on_bk = SQUARES == bk[:, None]
+
+    white_king = KING_ADJACENT_MASK[wk] & ~on_wp & ~KING_ADJACENT_MASK[bk]
+    # A captured White piece no longer attacks the Black King
+    black_king = KING_ADJACENT_MASK[bk] & ~(KING_ADJACENT_MASK[wk] & ~on_wk) & ~(PAWN_ATTACK_MASK[wp] & ~on_wp)
+    king_mask = np.where(white, white_king, black_king)
+
+    rows = np.arange(len(wp))
+    single = wp - 8
+    single_ok = (wp >= 8) & (single != wk) & (single != bk)
+    double = wp - 16
+    double_ok = single_ok & (wp // 8 == 6) & (double != wk) & (double != bk)
+    pushes = np.zeros_like(king_mask)
+    pushes[rows[single_ok], single[single_ok]] = True
+    pushes[rows[double_ok], double[double_ok]] = True
+    capture = PAWN_ATTACK_MASK[wp] & on_bk
+    # Pawn moves leave the White King where it is, so next to the Black King only capturing it is legal
+    king_safe = ~KING_ADJACENT_MASK[wk, bk][:, None]
+    pawn_mask = white & np.where(king_safe, pushes | capture, capture)
+    return king_mask, pawn_mask
+
+def masks_to_moves(wk, wp, bk, white_to_move, king_mask, pawn_mask):
+    # Converts the masks back to per-position lists of (from_sq, to_sq) moves, king moves first, each by destination square
+    moves = []
+    for i in range(len(king_mask)):
+        king_from = int(wk[i]) if white_to_move[i] else int(bk[i])
+        position_moves = [(king_from, int(to_sq)) for to_sq in np.flatnonzero(king_mask[i])]
+        position_moves += [(int(wp[i]), int(to_sq)) for to_sq in np.flatnonzero(pawn_mask[i])]
+        moves.append(position_moves)
+    return moves
+
+def verify(count, seed=0):
+    # Compares the batch functions with the engine on count random positions (all three pieces on
+    # distinct squares, either side to move) and returns the mismatches as text lines
+    rng = np.random.default_rng(seed)
+    squares = np.array([rng.choice(64, 3, replace=False) for _ in range(count)]).reshape(count, 3)
+    wk, wp, bk = squares.T
+    white_to_move = rng.random(count) < 0.5
+    checks = batch_in_check(wk, wp, bk, white_to_move)
+    scores = batch_evaluate(wk, wp, bk)
+    moves = masks_to_moves(wk, wp, bk, white_to_move, *batch_legal_move_masks(wk, wp, bk, white_to_move))
+    mismatches = []
+    for i in range(count):
+        position = Position(int(wk[i]), int(wp[i]), int(bk[i]), bool(white_to_move[i]))
+        name = f"wk={wk[i]} wp={wp[i]} bk={bk[i]} {'w' if white_to_move[i] else 'b'}"
+        if bool(checks[i]) != in_check(position, position.white_to_move):
+            mismatches.append(f"{name}: batch_in_check {bool(checks[i])}")
+        if int(scores[i]) != evaluate_board(position, {}):
+            mismatches.append(f"{name}: batch_evaluate {int(scores[i])}, evaluate_board {evaluate_board(position, {})}")
+        if sorted(moves[i]) != sorted(legal_moves(position)):
+            mismatches.append(f"{name}: batch moves {sorted(moves[i])}, legal_moves {sorted(legal_moves(position))}")
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the batch functions against engine.py position by position.")
+    parser.add_argument('--verify', type=int, metavar='N', default=100000, help="Random positions to compare (default 100000)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default 0)")
+    args = parser.parse_args(argv)
+    mismatches = verify(args.verify, args.seed)
+    for line in mismatches[:20]:
+        print(line, file=sys.stderr)
+    print(f"{args.verify} positions, {len(mismatches)} mismatches")
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()